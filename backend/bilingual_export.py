@@ -0,0 +1,246 @@
+"""
+Streaming bilingual exports (TMX, TSV and JSON Lines) from a loaded XLIFF tree
+
+Exports are generators that walk the trans-units one at a time and yield
+encoded chunks, so a response starts immediately and the output is never
+held in memory as a whole. The trans-units can come from a separate stream
+(copies read chunk by chunk) while file attributes are read from the tree.
+"""
+
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from xml.sax.saxutils import escape, quoteattr
+from lxml import etree
+from xliff_query import XliffQuery
+
+class BilingualExporter:
+    """Streams source/target pairs of an XLIFF tree in bilingual interchange formats"""
+
+    FORMATS = {
+        'tmx': ('application/x-tmx+xml', '.tmx'),
+        'tsv': ('text/tab-separated-values; charset=utf-8', '.tsv'),
+        'jsonl': ('application/x-ndjson', '.jsonl'),
+    }
+
+    # Inline tag handling: keep the markup or export plain text
+    TAG_MODES = ('render', 'strip')
+
+    # Inline elements whose text is translatable content (the rest hold native codes)
+    CONTENT_TAGS = {'g', 'mrk'}
+
+    # Bytes collected before a chunk is yielded
+    CHUNK_SIZE = 64 * 1024
+
+    @staticmethod
+    def iter_units(tree: etree.Element, states: Optional[Set[str]] = None, include_untranslated: bool = False,
+                   trans_units: Optional[Iterable[Tuple[int, etree.Element]]] = None) -> Iterator[Dict]:
+        """
+        File info and source/target elements of each trans-unit in document order
+        trans_units yields (file index, element) pairs in place of the tree's own trans-units
+        """
+        query = XliffQuery.for_element(tree)
+        # File attributes are read up front, so the tree isn't touched while the units stream
+        file_infos = [{
+            'original': file_elem.get('original'),
+            'source_language': file_elem.get('source-language'),
+            'target_language': file_elem.get('target-language'),
+        } for file_elem in query.files(tree)]
+        if trans_units is None:
+            trans_units = ((index, tu_elem) for index, file_elem in enumerate(query.files(tree))
+                           for tu_elem in query.file_trans_units(file_elem))
+        return BilingualExporter._filter_units(query, file_infos, trans_units, states, include_untranslated)
+
+    @staticmethod
+    def _filter_units(query: XliffQuery, file_infos: List[Dict], trans_units: Iterable[Tuple[int, etree.Element]],
+                      states: Optional[Set[str]], include_untranslated: bool) -> Iterator[Dict]:
+        for file_index, tu_elem in trans_units:
+            target_elem = tu_elem.find(query.target_tag)
+            state = target_elem.get('state') if target_elem is not None else None
+
+            if states is not None and state not in states:
+                continue
+            if not include_untranslated and (target_elem is None or not ''.join(target_elem.itertext()).strip()):
+                continue
+
+            yield {
+                'file': file_infos[file_index],
+                'id': tu_elem.get('id'),
+                'state': state,
+                'source': tu_elem.find(query.source_tag),
+                'target': target_elem,
+            }
+
+    @staticmethod
+    def strip_tags(element: Optional[etree.Element]) -> str:
+        """Plain text of a segment: content of <g>/<mrk> is kept, native codes are dropped"""
+        if element is None:
+            return ''
+        parts = [element.text or '']
+        for child in element:
+            if etree.QName(child).localname in BilingualExporter.CONTENT_TAGS:
+                parts.append(BilingualExporter.strip_tags(child))
+            parts.append(child.tail or '')
+        return ''.join(parts)
+
+    @staticmethod
+    def render_xliff(element: Optional[etree.Element]) -> str:
+        """Segment content with XLIFF inline markup, without namespace declarations"""
+        if element is None:
+            return ''
+        parts = [escape(element.text or '')]
+        for child in element:
+            if not isinstance(child.tag, str):
+                # Comments and processing instructions
+                parts.append(escape(child.tail or ''))
+                continue
+            name = etree.QName(child).localname
+            attributes = ''.join(f' {etree.QName(k).localname}={quoteattr(v)}' for k, v in child.attrib.items())
+            inner = BilingualExporter.render_xliff(child)
+            if inner:
+                parts.append(f'<{name}{attributes}>{inner}</{name}>')
+            else:
+                parts.append(f'<{name}{attributes}/>')
+            parts.append(escape(child.tail or ''))
+        return ''.join(parts)
+
+    @staticmethod
+    def render_tmx(element: Optional[etree.Element], _pairs: Optional[List[int]] = None) -> str:
+        """
+        Segment content with XLIFF inline tags mapped to TMX 1.4 inline elements
+        The XLIFF id is kept in x (and in i of the <bpt>/<ept> pair of a <g>), so
+        imports can map the codes back to the source tags
+        """
+        if element is None:
+            return ''
+        # Pair numbers of <g> elements without an id, shared by the whole segment
+        pairs = [0] if _pairs is None else _pairs
+        parts = [escape(element.text or '')]
+        for child in element:
+            if not isinstance(child.tag, str):
+                parts.append(escape(child.tail or ''))
+                continue
+            name = etree.QName(child).localname
+            tag_id = child.get('id')
+            ctype = child.get('ctype')
+            type_attr = f' type={quoteattr(ctype)}' if ctype else ''
+            x_attr = f' x={quoteattr(tag_id)}' if tag_id else ''
+            native = escape(''.join(child.itertext()))
+
+            if name == 'g':
+                if not tag_id:
+                    pairs[0] += 1
+                pair = quoteattr(tag_id or f'g{pairs[0]}')
+                attributes = ''.join(f' {etree.QName(k).localname}={quoteattr(v)}' for k, v in child.attrib.items())
+                parts.append(f'<bpt i={pair}{x_attr}{type_attr}>{escape(f"<g{attributes}>")}</bpt>')
+                parts.append(BilingualExporter.render_tmx(child, pairs))
+                parts.append(f'<ept i={pair}>{escape("</g>")}</ept>')
+            elif name == 'mrk':
+                parts.append(BilingualExporter.render_tmx(child, pairs))
+            elif name in ('bpt', 'bx'):
+                parts.append(f'<bpt i={quoteattr(child.get("rid") or tag_id or "")}{x_attr}{type_attr}>{native}</bpt>')
+            elif name in ('ept', 'ex'):
+                parts.append(f'<ept i={quoteattr(child.get("rid") or tag_id or "")}>{native}</ept>')
+            elif name == 'it':
+                pos = 'begin' if child.get('pos') == 'open' else 'end'
+                parts.append(f'<it pos="{pos}"{x_attr}{type_attr}>{native}</it>')
+            else:
+                # x, ph and unknown placeholders
+                parts.append(f'<ph{x_attr}{type_attr}>{native}</ph>')
+            parts.append(escape(child.tail or ''))
+        return ''.join(parts)
+
+    @staticmethod
+    def _chunked(parts: Iterator[str]) -> Iterator[bytes]:
+        """Join small strings into encoded chunks of about CHUNK_SIZE bytes"""
+        buffer: List[str] = []
+        size = 0
+        for part in parts:
+            buffer.append(part)
+            size += len(part)
+            if size >= BilingualExporter.CHUNK_SIZE:
+                yield ''.join(buffer).encode('utf-8')
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer).encode('utf-8')
+
+    @staticmethod
+    def export(tree: etree.Element, fmt: str, tags: str = 'render',
+               states: Optional[Set[str]] = None, include_untranslated: bool = False,
+               trans_units: Optional[Iterable[Tuple[int, etree.Element]]] = None) -> Iterator[bytes]:
+        """Stream the tree (or the given trans-units of it) in the given format ('tmx', 'tsv' or 'jsonl')"""
+        if fmt not in BilingualExporter.FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(BilingualExporter.FORMATS)}")
+        if tags not in BilingualExporter.TAG_MODES:
+            raise ValueError(f"Unknown tag mode '{tags}', expected one of {', '.join(BilingualExporter.TAG_MODES)}")
+
+        units = BilingualExporter.iter_units(tree, states, include_untranslated, trans_units)
+        if fmt == 'tmx':
+            render = BilingualExporter.render_tmx if tags == 'render' else (lambda e: escape(BilingualExporter.strip_tags(e)))
+            first_file = tree.find(XliffQuery.for_element(tree).file_tag)
+            srclang = first_file.get('source-language', '*all*') if first_file is not None else '*all*'
+            parts = BilingualExporter._tmx_parts(srclang, units, render)
+        else:
+            render = BilingualExporter.render_xliff if tags == 'render' else BilingualExporter.strip_tags
+            if fmt == 'tsv':
+                parts = BilingualExporter._tsv_parts(units, render)
+            else:
+                parts = BilingualExporter._jsonl_parts(units, render)
+
+        return BilingualExporter._chunked(parts)
+
+    @staticmethod
+    def _tmx_parts(srclang: str, units: Iterator[Dict], render: Callable) -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<tmx version="1.4">\n'
+        yield (f'  <header creationtool="XLIFF Editor" creationtoolversion="1.0" datatype="xml" '
+               f'segtype="sentence" adminlang="en" srclang={quoteattr(srclang)} o-tmf="xliff"/>\n  <body>\n')
+
+        for unit in units:
+            file_info = unit['file']
+            props = f'      <prop type="x-original">{escape(file_info["original"] or "")}</prop>\n'
+            if unit['state']:
+                props += f'      <prop type="x-state">{escape(unit["state"])}</prop>\n'
+            yield (
+                f'    <tu tuid={quoteattr(unit["id"] or "")}>\n{props}'
+                f'      <tuv xml:lang={quoteattr(file_info["source_language"] or "")}><seg>{render(unit["source"])}</seg></tuv>\n'
+                f'      <tuv xml:lang={quoteattr(file_info["target_language"] or "")}><seg>{render(unit["target"])}</seg></tuv>\n'
+                f'    </tu>\n'
+            )
+
+        yield '  </body>\n</tmx>\n'
+
+    @staticmethod
+    def escape_tsv(value: str) -> str:
+        """Backslash-escape characters that would break a TSV row"""
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\r', '\\r').replace('\n', '\\n'))
+
+    @staticmethod
+    def _tsv_parts(units: Iterator[Dict], render: Callable) -> Iterator[str]:
+        esc = BilingualExporter.escape_tsv
+        yield 'file\tid\tstate\tsource_language\ttarget_language\tsource\ttarget\n'
+        for unit in units:
+            file_info = unit['file']
+            yield '\t'.join((
+                esc(file_info['original'] or ''),
+                esc(unit['id'] or ''),
+                esc(unit['state'] or ''),
+                esc(file_info['source_language'] or ''),
+                esc(file_info['target_language'] or ''),
+                esc(render(unit['source'])),
+                esc(render(unit['target'])),
+            )) + '\n'
+
+    @staticmethod
+    def _jsonl_parts(units: Iterator[Dict], render: Callable) -> Iterator[str]:
+        for unit in units:
+            file_info = unit['file']
+            yield json.dumps({
+                'file': file_info['original'],
+                'id': unit['id'],
+                'state': unit['state'],
+                'source_language': file_info['source_language'],
+                'target_language': file_info['target_language'],
+                'source': render(unit['source']),
+                'target': render(unit['target']) if unit['target'] is not None else None,
+            }, ensure_ascii=False) + '\n'
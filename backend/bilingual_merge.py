@@ -0,0 +1,480 @@
+"""
+Bulk merge of external bilingual files (XLIFF, TMX, TSV, JSON Lines) into a loaded document
+
+Incoming files are read as a stream of records. Each record is matched to a
+trans-unit by id (scoped to the file's original when known) and otherwise by
+a hash of its normalized source text. Targets are collected as store edits and
+applied through the same reconstruct_segment path as single updates. SDLXLIFF
+units with sub-segments are merged segment by segment, so their <mrk>
+segmentation is kept.
+"""
+
+import codecs
+import csv
+import hashlib
+import json
+import re
+from typing import BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from lxml import etree
+from models import MergeConflict, MergeReport, SdlSegment, SegmentContent, TransUnit, XliffDocument, XliffTag
+from sdlxliff_handler import SdlXliffHandler
+from xliff_parser import XliffParser
+from xliff_query import XliffQuery
+
+class MergeRecord(NamedTuple):
+    """One source/target pair read from an incoming bilingual file"""
+    file: Optional[str]  # original of the <file> it came from, if known
+    id: Optional[str]
+    source: Optional[str]  # Source text (tags as markers), only used for matching
+    target: SegmentContent
+    # TMX source with its inline codes; the codes of source and target are mapped
+    # onto the matched unit's source tags (BilingualReader.map_tmx_codes)
+    tmx_source: Optional[SegmentContent] = None
+    # Target of each SDLXLIFF sub-segment by mid, if the record kept its <mrk mtype="seg">
+    segments: Optional[Dict[str, SegmentContent]] = None
+
+class BilingualReader:
+    """Streaming readers turning bilingual files into MergeRecords"""
+
+    XLIFF_EXTENSIONS = ('.xliff', '.xlf', '.sdlxliff')
+    TSV_EXTENSIONS = ('.tsv', '.tab', '.txt')
+
+    @staticmethod
+    def read(fileobj: BinaryIO, filename: str, source_language: Optional[str] = None) -> Iterator[MergeRecord]:
+        """Pick a reader from the file extension"""
+        name = filename.lower()
+        if name.endswith(BilingualReader.XLIFF_EXTENSIONS):
+            return BilingualReader.read_xliff(fileobj)
+        if name.endswith('.tmx'):
+            return BilingualReader.read_tmx(fileobj, source_language)
+        if name.endswith(BilingualReader.TSV_EXTENSIONS):
+            return BilingualReader.read_tsv(fileobj)
+        if name.endswith(('.jsonl', '.ndjson')):
+            return BilingualReader.read_jsonl(fileobj)
+        raise ValueError("File must be XLIFF (.xliff, .xlf, .sdlxliff), TMX (.tmx), TSV (.tsv) or JSON Lines (.jsonl)")
+
+    @staticmethod
+    def read_xliff(fileobj: BinaryIO) -> Iterator[MergeRecord]:
+        """Read trans-units of an XLIFF file (any version or namespace)"""
+        for original, elem in XliffQuery.iterparse_trans_units(fileobj):
+            query = XliffQuery.for_element(elem)
+            source_elem = elem.find(query.source_tag)
+            target_elem = elem.find(query.target_tag)
+
+            if target_elem is not None:
+                yield MergeRecord(
+                    file=original,
+                    id=elem.get('id'),
+                    source=XliffParser.segment_text(source_elem),
+                    target=XliffParser.parse_segment(target_elem),
+                    segments=SdlXliffHandler.segment_contents(target_elem) or None
+                )
+
+    # XLIFF tag types a TMX inline code can stand for
+    TMX_CODES = {
+        'bpt': ('g', 'bpt', 'bx'),
+        'ept': ('ept', 'ex'),
+        'ph': ('x', 'ph'),
+        'it': ('it', 'bx', 'ex', 'x', 'ph'),
+    }
+
+    @staticmethod
+    def _tmx_tag(code: XliffTag, position: int) -> XliffTag:
+        """A TMX code that matches no source tag, kept as is (TMX x/i/type become id/ctype)"""
+        attributes = dict(code.attributes)
+        x, i, code_type = attributes.pop('x', None), attributes.pop('i', None), attributes.pop('type', None)
+        return code.model_copy(update={
+            'id': code.id or x or i,
+            'ctype': code.ctype or code_type,
+            'attributes': attributes,
+            'position': position,
+        })
+
+    @staticmethod
+    def map_tmx_codes(content: SegmentContent, source_tags: List[XliffTag]) -> SegmentContent:
+        """
+        Turn the TMX inline codes of a segment back into a unit's source tags
+        Codes are matched by x (the XLIFF id), then by i, then in order. The text
+        between the <bpt>/<ept> of a <g> becomes its content, as XliffParser reads it.
+        """
+        remaining = list(source_tags)
+
+        def match(code: XliffTag) -> Optional[XliffTag]:
+            kinds = BilingualReader.TMX_CODES.get(code.tag_type, (code.tag_type,))
+            candidates = [tag for tag in remaining if tag.tag_type in kinds]
+            for key in (code.attributes.get('x'), code.attributes.get('i')):
+                if key is not None:
+                    found = next((tag for tag in candidates if tag.id == key), None)
+                    if found is not None:
+                        return found
+            return candidates[0] if candidates else None
+
+        text = content.text
+        parts: List[str] = []
+        tags: List[XliffTag] = []
+        position = 0
+        last = 0
+        group: Optional[XliffTag] = None  # <g> whose codes are open
+        group_pair = None  # i of its <bpt>
+        group_text = False  # Its content was read
+
+        def add(value: str):
+            nonlocal position, group_text
+            if group is None:
+                parts.append(value)
+                position += len(value)
+            elif not group_text:
+                group.content = value or None
+                group_text = True
+
+        for code in sorted(content.tags, key=lambda tag: tag.position):
+            add(text[last:code.position])
+            last = code.position + len(f'⟨{code.tag_type}⟩')
+
+            if group is not None:
+                # Codes nested in a <g> have no place in the model; its <ept> closes it
+                if code.tag_type == 'ept' and (group_pair is None or code.attributes.get('i') in (None, group_pair)):
+                    group = None
+                else:
+                    group_text = True
+                continue
+
+            source_tag = match(code)
+            if source_tag is None:
+                tag = BilingualReader._tmx_tag(code, position)
+            else:
+                remaining.remove(source_tag)
+                tag = source_tag.model_copy(update={'position': position})
+            tags.append(tag)
+            marker = f'⟨{tag.tag_type}⟩'
+            parts.append(marker)
+            position += len(marker)
+
+            if tag.tag_type == 'g' and code.tag_type == 'bpt':
+                tag.content = None
+                group, group_pair, group_text = tag, code.attributes.get('i'), False
+        add(text[last:])
+
+        return SegmentContent(text=''.join(parts), tags=tags)
+
+    @staticmethod
+    def read_tmx(fileobj: BinaryIO, source_language: Optional[str] = None) -> Iterator[MergeRecord]:
+        """Read translation units of a TMX file; the source is the variant in source_language"""
+        lang_attr = '{http://www.w3.org/XML/1998/namespace}lang'
+        source_prefix = (source_language or '').lower().split('-')[0]
+
+        for _, tu_elem in etree.iterparse(fileobj, events=('end',), tag='{*}tu', huge_tree=True):
+            variants: List[Tuple[str, etree.Element]] = []
+            for tuv in tu_elem:
+                if not isinstance(tuv.tag, str) or etree.QName(tuv).localname != 'tuv':
+                    continue
+                seg = next((child for child in tuv if isinstance(child.tag, str)
+                            and etree.QName(child).localname == 'seg'), None)
+                if seg is not None:
+                    lang = (tuv.get(lang_attr) or tuv.get('lang') or '').lower()
+                    variants.append((lang, seg))
+
+            if len(variants) >= 2:
+                source_index = 0
+                if source_prefix:
+                    source_index = next((i for i, (lang, _) in enumerate(variants)
+                                         if lang.split('-')[0] == source_prefix), 0)
+                target_index = 1 if source_index == 0 else 0
+                yield MergeRecord(
+                    file=None,
+                    id=tu_elem.get('tuid'),
+                    source=XliffParser.segment_text(variants[source_index][1]),
+                    target=XliffParser.parse_segment(variants[target_index][1]),
+                    tmx_source=XliffParser.parse_segment(variants[source_index][1])
+                )
+            XliffQuery.release(tu_elem)
+
+    @staticmethod
+    def parse_markup(value: str) -> SegmentContent:
+        """Parse text that may contain XLIFF inline markup (as written by the exporter)"""
+        if '<' not in value and '&' not in value:
+            return SegmentContent(text=value)
+        try:
+            return XliffParser.parse_segment(etree.fromstring(f'<seg>{value}</seg>'))
+        except etree.XMLSyntaxError:
+            return SegmentContent(text=value)
+
+    @staticmethod
+    def markup_segments(value: str) -> Optional[Dict[str, SegmentContent]]:
+        """Sub-segments of a value with XLIFF inline markup, if it has <mrk mtype="seg"> elements"""
+        if 'mtype="seg"' not in value:
+            return None
+        try:
+            return SdlXliffHandler.segment_contents(etree.fromstring(f'<seg>{value}</seg>')) or None
+        except etree.XMLSyntaxError:
+            return None
+
+    @staticmethod
+    def markup_text(value: str) -> str:
+        """Text (tags as markers) of a value that may contain XLIFF inline markup"""
+        if '<' not in value and '&' not in value:
+            return value
+        try:
+            return XliffParser.segment_text(etree.fromstring(f'<seg>{value}</seg>'))
+        except etree.XMLSyntaxError:
+            return value
+
+    @staticmethod
+    def _unescape_tsv(value: str) -> str:
+        """Reverse BilingualExporter.escape_tsv"""
+        if '\\' not in value:
+            return value
+        return re.sub(r'\\([\\tnr])', lambda m: {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r'}[m.group(1)], value)
+
+    @staticmethod
+    def read_tsv(fileobj: BinaryIO) -> Iterator[MergeRecord]:
+        """
+        Read a TSV file with a header naming at least 'target' (plus 'source', 'id', 'file'),
+        or a header-less file of source<TAB>target rows
+        """
+        lines = codecs.getreader('utf-8-sig')(fileobj)
+        rows = csv.reader(lines, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = {name.strip().lower(): i for i, name in enumerate(header)}
+        if 'target' not in columns:
+            # No header: the first row is data
+            columns = {'source': 0, 'target': 1}
+            rows_iter = iter([header])
+        else:
+            rows_iter = iter(())
+
+        def cell(row: List[str], name: str) -> Optional[str]:
+            i = columns.get(name)
+            if i is None or i >= len(row):
+                return None
+            return BilingualReader._unescape_tsv(row[i])
+
+        for source_rows in (rows_iter, rows):
+            for row in source_rows:
+                target = cell(row, 'target')
+                if target is None:
+                    continue
+                source = cell(row, 'source')
+                yield MergeRecord(
+                    file=cell(row, 'file') or None,
+                    id=cell(row, 'id') or None,
+                    source=BilingualReader.markup_text(source) if source is not None else None,
+                    target=BilingualReader.parse_markup(target),
+                    segments=BilingualReader.markup_segments(target)
+                )
+
+    @staticmethod
+    def read_jsonl(fileobj: BinaryIO) -> Iterator[MergeRecord]:
+        """Read JSON Lines with 'target' and optional 'source', 'id', 'file' fields"""
+        for line in codecs.getreader('utf-8-sig')(fileobj):
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get('target') is None:
+                continue
+            yield MergeRecord(
+                file=data.get('file'),
+                id=data.get('id'),
+                source=BilingualReader.markup_text(data['source']) if data.get('source') is not None else None,
+                target=BilingualReader.parse_markup(data['target']),
+                segments=BilingualReader.markup_segments(data['target'])
+            )
+
+class BilingualMerger:
+    """Matches incoming records against a document and collects the target edits to apply"""
+
+    # Conflicts listed in the report (all of them are counted)
+    MAX_CONFLICTS_REPORTED = 1000
+
+    WHITESPACE = re.compile(r'\s+')
+
+    def __init__(self, document: XliffDocument,
+                 segments: Optional[Callable[[int, TransUnit], List[SdlSegment]]] = None):
+        """segments parses the sub-segments of a unit; without it units are merged as a whole"""
+        self.document = document
+        self.segments = segments
+        self.originals = {xliff_file.original: i for i, xliff_file in enumerate(document.files)}
+        self._by_id: Optional[Dict[str, List[int]]] = None
+        self._by_source: Optional[Dict[bytes, List[Tuple[int, int]]]] = None
+        self._positions: Dict[Tuple[int, str], int] = {}
+
+        for file_index, xliff_file in enumerate(document.files):
+            for position, trans_unit in enumerate(xliff_file.trans_units):
+                self._positions.setdefault((file_index, trans_unit.id), position)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Source text without tag markers and with collapsed whitespace"""
+        return BilingualMerger.WHITESPACE.sub(' ', XliffParser.TAG_MARKER.sub('', text)).strip()
+
+    @staticmethod
+    def source_hash(text: Optional[str]) -> Optional[bytes]:
+        if text is None:
+            return None
+        normalized = BilingualMerger.normalize(text)
+        if not normalized:
+            return None
+        return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+    def _files_with_id(self, trans_unit_id: str) -> List[int]:
+        if self._by_id is None:
+            self._by_id = {}
+            for file_index, tu_id in self._positions:
+                self._by_id.setdefault(tu_id, []).append(file_index)
+        return self._by_id.get(trans_unit_id, [])
+
+    def _units_with_source(self, digest: bytes) -> List[Tuple[int, int]]:
+        """(file_index, position) of units whose normalized source hashes to digest (built on first use)"""
+        if self._by_source is None:
+            self._by_source = {}
+            for file_index, xliff_file in enumerate(self.document.files):
+                for position, trans_unit in enumerate(xliff_file.trans_units):
+                    unit_digest = self.source_hash(trans_unit.source.text if trans_unit.source else None)
+                    if unit_digest is not None:
+                        self._by_source.setdefault(unit_digest, []).append((file_index, position))
+        return self._by_source.get(digest, [])
+
+    @staticmethod
+    def _same_content(a: Optional[SegmentContent], b: SegmentContent) -> bool:
+        if a is None:
+            return False
+        return a.text == b.text and [t.model_dump() for t in a.tags] == [t.model_dump() for t in b.tags]
+
+    def _segment_targets(self, record: MergeRecord, file_index: int,
+                         unit: TransUnit) -> Tuple[Optional[Dict[str, SegmentContent]], List[SdlSegment]]:
+        """
+        Record targets by mid for a unit with sub-segments, with the unit's current segments
+        None if the record can't be split along the unit's segmentation
+        """
+        segments = self.segments(file_index, unit)
+        record_segments = record.segments
+        if record_segments is None and len(segments) == 1:
+            # A record of a single-segment unit is that segment
+            record_segments = {segments[0].mid: record.target}
+        if record_segments is None or not set(record_segments) <= {segment.mid for segment in segments}:
+            return None, segments
+        return record_segments, segments
+
+    def merge(self, records: Iterator[MergeRecord], overwrite: bool = False,
+              match_by_source: bool = True) -> Tuple[Dict[Tuple[int, str, Optional[str]], SegmentContent], MergeReport]:
+        """
+        Match records to trans-units
+        Returns the targets to apply keyed by (file_index, trans_unit_id, mid), where mid is
+        None for whole targets, and the merge report
+        """
+        report = MergeReport()
+        targets: Dict[Tuple[int, str, Optional[str]], SegmentContent] = {}
+        conflicts: List[MergeConflict] = []
+
+        def conflict(file_index: int, trans_unit_id: str, reason: str):
+            report.conflicting += 1
+            if len(conflicts) < self.MAX_CONFLICTS_REPORTED:
+                conflicts.append(MergeConflict(file_index=file_index, trans_unit_id=trans_unit_id, reason=reason))
+
+        for record in records:
+            report.total += 1
+            if not record.target.text.strip():
+                report.skipped += 1
+                continue
+
+            # Match by id, within the record's file when it is known
+            matches: List[Tuple[int, int]] = []
+            by_source = False
+            if record.id is not None:
+                if record.file is not None and record.file in self.originals:
+                    file_indexes = [self.originals[record.file]]
+                else:
+                    file_indexes = self._files_with_id(record.id)
+                for file_index in file_indexes:
+                    position = self._positions.get((file_index, record.id))
+                    if position is not None:
+                        matches.append((file_index, position))
+                        break
+
+            if matches and record.source is not None:
+                file_index, position = matches[0]
+                unit = self.document.files[file_index].trans_units[position]
+                source = record.source
+                if record.tmx_source is not None:
+                    source = BilingualReader.map_tmx_codes(record.tmx_source, unit.source.tags if unit.source else []).text
+                if self.normalize(unit.source.text if unit.source else '') != self.normalize(source):
+                    # Same id, different source: the segment changed since the file was exported
+                    conflict(file_index, unit.id, 'source-differs')
+                    continue
+
+            # Fall back to the normalized source
+            if not matches and match_by_source:
+                digest = self.source_hash(record.source)
+                if digest is not None:
+                    matches = self._units_with_source(digest)
+                    by_source = bool(matches)
+
+            if not matches:
+                report.skipped += 1
+                continue
+
+            applied = had_conflict = False
+            for file_index, position in matches:
+                unit = self.document.files[file_index].trans_units[position]
+                if self.segments is not None and unit.segment_ids:
+                    # Sub-segments are merged one by one, never by rewriting the whole target
+                    record_segments, segments = self._segment_targets(record, file_index, unit)
+                    if record_segments is None:
+                        conflict(file_index, unit.id, 'segmentation-differs')
+                        had_conflict = True
+                        continue
+                    unit_conflict = None
+                    for segment in segments:
+                        target = record_segments.get(segment.mid)
+                        if target is None or not target.text.strip():
+                            continue
+                        if record.tmx_source is not None:
+                            target = BilingualReader.map_tmx_codes(target, segment.source.tags if segment.source else [])
+                        key = (file_index, unit.id, segment.mid)
+                        current = targets.get(key, segment.target)
+                        if self._same_content(current, target):
+                            continue
+                        if segment.locked:
+                            unit_conflict = 'segment-locked'
+                            continue
+                        if current is not None and current.text.strip() and not overwrite and key not in targets:
+                            unit_conflict = unit_conflict or 'target-differs'
+                            continue
+                        targets[key] = target
+                        applied = True
+                    if unit_conflict is not None:
+                        conflict(file_index, unit.id, unit_conflict)
+                        had_conflict = True
+                    continue
+
+                key = (file_index, unit.id, None)
+                current = targets.get(key, unit.target)
+                target = record.target
+                if record.tmx_source is not None:
+                    target = BilingualReader.map_tmx_codes(target, unit.source.tags if unit.source else [])
+
+                if self._same_content(current, target):
+                    continue
+                if current is not None and current.text.strip() and not overwrite and key not in targets:
+                    conflict(file_index, unit.id, 'target-differs')
+                    had_conflict = True
+                    continue
+
+                targets[key] = target
+                applied = True
+
+            if applied:
+                report.matched += 1
+                if by_source:
+                    report.matched_by_source += 1
+            elif not had_conflict:
+                # Every matched unit already has this target
+                report.skipped += 1
+
+        report.conflicts = conflicts
+        report.updated_units = len({(file_index, trans_unit_id) for file_index, trans_unit_id, _ in targets})
+        return targets, report
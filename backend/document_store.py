@@ -0,0 +1,707 @@
+"""
+Shared document storage for running the API with several worker processes
+
+Documents live in a SQLite database that every worker on the machine opens.
+The original XLIFF bytes are stored once; edits are stored per unit (latest
+state only) together with a unit version and a document-wide sequence number.
+Each worker keeps a parsed copy of the documents it serves and catches up by
+replaying the edits with a sequence number above the one it has applied.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from lxml import etree
+from models import GlossaryInfo, SegmentTerms, TransUnit, XliffDocument, XliffTag
+from xliff_parser import XliffParser
+from parallel_parser import ParallelParser
+from xliff_query import XliffQuery
+from xliff_serializer import IncrementalSerializer
+from segment_index import SegmentIndex
+from sdlxliff_handler import SdlSegmentIndex, SdlXliffHandler
+from glossary import Glossary, GlossaryCache, GlossaryEntry
+
+class DocumentNotFound(Exception):
+    """Raised when a document id is not in the store"""
+
+class GlossaryNotFound(Exception):
+    """Raised when a glossary id is not in the store"""
+
+class VersionConflict(Exception):
+    """Raised when a unit changed since the version the client based its edit on"""
+
+    def __init__(self, kind: str, file_index: int, unit_id: str, expected: int, current: int):
+        super().__init__(
+            f"{kind} {unit_id} in file {file_index} is at version {current}, expected {expected}"
+        )
+        self.kind = kind
+        self.file_index = file_index
+        self.unit_id = unit_id
+        self.expected = expected
+        self.current = current
+
+class UnitEdit(NamedTuple):
+    """A full-state edit of one unit; a newer edit of the same unit replaces it"""
+    kind: str  # 'target', 'sdl-target' or 'sdl-status'
+    file_index: int
+    unit_id: str
+    payload: Dict[str, Any]
+    expected_version: Optional[int] = None  # None skips the concurrency check
+
+class ReadWriteLock:
+    """
+    Lock shared by any number of readers or held by one writer
+    Waiting writers keep new readers out, so catch-up edits are not starved. Not reentrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+class LoadedDocument:
+    """
+    A worker-local parsed copy of a stored document
+    Catch-up edits change the tree, the model and the indexes under lock.write();
+    request handlers read them under lock.read()
+    """
+
+    # Glossaries whose annotations are kept (least recently used ones are dropped)
+    TERMS_SIZE = 4
+
+    def __init__(self, doc_id: str, filename: str, is_xlz: bool,
+                 skeleton_files: Dict[str, bytes], content: bytes):
+        self.id = doc_id
+        self.filename = filename
+        self.is_xlz = is_xlz
+        self.skeleton_files = skeleton_files
+        self.tree = etree.fromstring(content)
+        self.query = XliffQuery.for_element(self.tree)
+        self.document = ParallelParser.parse(content, self.tree)
+        self.document.document_id = doc_id
+        self.index = SegmentIndex(self.document)
+        self.version = 0
+        self.lock = ReadWriteLock()
+        self.unit_versions: Dict[Tuple[str, int, str], int] = {}
+        self._sdl: Optional[SdlSegmentIndex] = None
+        self._elements: Optional[Dict[Tuple[int, str], etree.Element]] = None
+        self._serializer: Optional[IncrementalSerializer] = None
+        # Serialized downloads of the current version by content encoding
+        self._downloads: Dict[Optional[str], bytes] = {}
+        self._downloads_version = 0
+        # Glossary annotations by glossary content hash, kept up to date on edits
+        self._terms: 'OrderedDict[str, Tuple[Glossary, Dict[Tuple[int, str], SegmentTerms]]]' = OrderedDict()
+        # Structures built on first use are built once, even by concurrent readers
+        self._build_lock = threading.Lock()
+
+    @property
+    def sdl(self) -> SdlSegmentIndex:
+        """Index of SDLXLIFF segment definitions, built on first use"""
+        with self._build_lock:
+            if self._sdl is None:
+                self._sdl = SdlSegmentIndex(self.tree)
+            return self._sdl
+
+    @property
+    def serializer(self) -> IncrementalSerializer:
+        """Chunked serializer of the tree, built on the first download and kept up to date by edits"""
+        with self._build_lock:
+            if self._serializer is None:
+                self._serializer = IncrementalSerializer(self.tree)
+            return self._serializer
+
+    def snapshot(self) -> XliffDocument:
+        """Copy of the document model that later edits leave alone (edits replace trans-units, never change them)"""
+        with self.lock.read():
+            return self.document.model_copy(update={'document_version': self.version, 'files': [
+                xliff_file.model_copy(update={'trans_units': list(xliff_file.trans_units)})
+                for xliff_file in self.document.files
+            ]})
+
+    def iter_trans_units(self) -> Iterator[Tuple[int, etree.Element]]:
+        """
+        (file index, copy of the element) of each trans-unit in document order, for long
+        reads (streamed exports, diffs) that shouldn't hold the lock. Each serializer chunk
+        is read under a short read lock and parsed on its own
+        """
+        with self.lock.read():
+            serializer = self.serializer
+            chunks = list(serializer.chunks)
+        for chunk in chunks:
+            if chunk.file_index is None:
+                continue
+            with self.lock.read():
+                data = serializer.chunk_data(chunk)
+            fragment = serializer.parse_chunk(chunk, data)
+            for tu_elem in self.query.trans_units(fragment):
+                yield chunk.file_index, tu_elem
+
+    def trans_unit_element(self, file_index: int, trans_unit_id: str):
+        """Look up a trans-unit element by file index and id (map built on first use)"""
+        with self._build_lock:
+            if self._elements is None:
+                elements = {}
+                for index, file_elem in enumerate(self.query.files(self.tree)):
+                    for tu_elem in self.query.file_trans_units(file_elem):
+                        elements.setdefault((index, tu_elem.get('id')), tu_elem)
+                self._elements = elements
+
+        return self._elements.get((file_index, trans_unit_id))
+
+    def cached_download(self, encoding: Optional[str], build: Callable[[], bytes]) -> bytes:
+        """Download body for a content encoding, built once per document version"""
+        if self._downloads_version != self.version:
+            self._downloads = {}
+            self._downloads_version = self.version
+
+        body = self._downloads.get(encoding)
+        if body is None:
+            body = self._downloads[encoding] = build()
+        return body
+
+    def term_annotations(self, glossary: Glossary) -> Dict[Tuple[int, str], SegmentTerms]:
+        """
+        Glossary hits of every trans-unit (annotated once per glossary, then on edits)
+        Call under lock.read(); concurrent first calls wait for one annotation pass
+        """
+        with self._build_lock:
+            cached = self._terms.get(glossary.content_hash)
+            if cached is None:
+                annotations = {}
+                for file_index, xliff_file in enumerate(self.document.files):
+                    for trans_unit in xliff_file.trans_units:
+                        annotations[(file_index, trans_unit.id)] = self._annotate(glossary, file_index, trans_unit)
+                cached = self._terms[glossary.content_hash] = (glossary, annotations)
+                while len(self._terms) > self.TERMS_SIZE:
+                    self._terms.popitem(last=False)
+            self._terms.move_to_end(glossary.content_hash)
+        return cached[1]
+
+    def forget_glossary(self, content_hash: str):
+        """Drop the annotations of a deleted glossary"""
+        with self._build_lock:
+            self._terms.pop(content_hash, None)
+
+    @staticmethod
+    def _annotate(glossary: Glossary, file_index: int, trans_unit: TransUnit) -> SegmentTerms:
+        return glossary.annotate(file_index, trans_unit.id, trans_unit.source.text,
+                                 trans_unit.target.text if trans_unit.target else None)
+
+    def unit_version(self, kind: str, file_index: int, unit_id: str) -> int:
+        """Current version of a unit (0 if it was never edited)"""
+        return self.unit_versions.get((kind, file_index, unit_id), 0)
+
+    def apply_edits(self, edits: List[Tuple[str, int, str, Dict[str, Any], int]]):
+        """
+        Apply stored edits, given as (kind, file_index, unit_id, payload, version),
+        to the tree and the parsed document, then re-index the changed trans-units in one batch
+        """
+        changed: Dict[Tuple[int, str], TransUnit] = {}
+        for kind, file_index, unit_id, payload, version in edits:
+            trans_unit = self.apply_edit(kind, file_index, unit_id, payload, version)
+            if trans_unit is not None:
+                changed[(file_index, trans_unit.id)] = trans_unit
+
+        self.index.update_units([(file_index, trans_unit) for (file_index, _), trans_unit in changed.items()])
+        # A copy, as a deleted glossary can be dropped meanwhile
+        for glossary, annotations in list(self._terms.values()):
+            for (file_index, trans_unit_id), trans_unit in changed.items():
+                annotations[(file_index, trans_unit_id)] = self._annotate(glossary, file_index, trans_unit)
+
+    def apply_edit(self, kind: str, file_index: int, unit_id: str,
+                   payload: Dict[str, Any], version: int) -> Optional[TransUnit]:
+        """
+        Apply a stored edit to the tree and the parsed document
+        Returns the re-parsed trans-unit if its content changed (it still needs re-indexing)
+        """
+        trans_unit = None
+        if kind == 'target' and payload is None:
+            # Version bump of a trans-unit whose sub-segments were edited
+            version = max(version, self.unit_version(kind, file_index, unit_id))
+            edited = None
+        elif kind == 'target':
+            trans_unit = self._apply_target(file_index, unit_id, payload, version)
+            edited = self.trans_unit_element(file_index, unit_id)
+        elif kind == 'sdl-target':
+            trans_unit = self._apply_sdl_target(file_index, unit_id, payload)
+            edited = self.trans_unit_element(file_index, payload['trans_unit_id'])
+        elif kind == 'sdl-status':
+            self.sdl.set_status(file_index, unit_id, payload.get('conf'), payload.get('locked', False))
+            edited = self.sdl.trans_units.get((file_index, unit_id))
+        else:
+            raise ValueError(f"Unknown edit kind '{kind}'")
+        self.unit_versions[(kind, file_index, unit_id)] = version
+
+        # Only the serialized chunk holding the edited trans-unit is re-encoded on the next download
+        if self._serializer is not None and edited is not None:
+            self._serializer.mark_dirty(edited)
+        return trans_unit
+
+    def _apply_target(self, file_index: int, unit_id: str, payload: Dict[str, Any], version: int):
+        position = self.index.locate(file_index, unit_id)
+        tu_elem = self.trans_unit_element(file_index, unit_id)
+        if position is None or tu_elem is None:
+            return None
+
+        target_elem = XliffParser.update_target_element(
+            tu_elem,
+            payload['target_text'],
+            [XliffTag(**tag) for tag in payload.get('target_tags', [])],
+            state=payload.get('state')
+        )
+        return self.refresh_target(file_index, position, target_elem, version)
+
+    def _apply_sdl_target(self, file_index: int, mid: str, payload: Dict[str, Any]):
+        trans_unit_id = payload['trans_unit_id']
+        # The edit bumped the trans-unit's version too, so whole-target updates based on the old one conflict
+        unit_version = max(payload.get('unit_version', 0), self.unit_version('target', file_index, trans_unit_id))
+        self.unit_versions[('target', file_index, trans_unit_id)] = unit_version
+        position = self.index.locate(file_index, trans_unit_id)
+        tu_elem = self.trans_unit_element(file_index, trans_unit_id)
+        if position is None or tu_elem is None:
+            return None
+
+        updated = SdlXliffHandler.update_segment_target(
+            tu_elem,
+            mid,
+            payload['target_text'],
+            [XliffTag(**tag) for tag in payload.get('target_tags', [])]
+        )
+        if not updated:
+            return None
+        return self.refresh_target(file_index, position, SdlXliffHandler.child(tu_elem, 'target'), unit_version)
+
+    def refresh_target(self, file_index: int, position: int, target_elem, version: int) -> TransUnit:
+        """Re-parse an edited target element into the document model (the rest of the unit is kept)"""
+        trans_units = self.document.files[file_index].trans_units
+        trans_unit = trans_units[position].model_copy(update={
+            'target': XliffParser.parse_segment(target_elem),
+            'state': target_elem.get('state') if target_elem is not None else None,
+            'version': version,
+        })
+        trans_units[position] = trans_unit
+        return trans_unit
+
+class DocumentStore:
+    """SQLite-backed document store shared by all worker processes on one machine"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            is_xlz INTEGER NOT NULL DEFAULT 0,
+            content BLOB NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS skeleton_files (
+            doc_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            content BLOB NOT NULL,
+            PRIMARY KEY (doc_id, name)
+        );
+        CREATE TABLE IF NOT EXISTS unit_edits (
+            doc_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            file_index INTEGER NOT NULL,
+            unit_id TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (doc_id, kind, file_index, unit_id)
+        );
+        CREATE INDEX IF NOT EXISTS unit_edits_seq ON unit_edits (doc_id, seq);
+        CREATE TABLE IF NOT EXISTS glossaries (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            source_language TEXT,
+            target_language TEXT,
+            case_sensitive INTEGER NOT NULL DEFAULT 0,
+            stemming INTEGER NOT NULL DEFAULT 0,
+            entry_count INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            entries TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    # Number of parsed documents each worker keeps in memory
+    CACHE_SIZE = 4
+
+    # Seconds between updates of a document's last access time by a worker
+    ACCESS_INTERVAL = 60
+
+    def __init__(self, path: str, retention_days: Optional[float] = None, max_documents: Optional[int] = None):
+        """
+        Documents unused for retention_days (XLIFF_RETENTION_DAYS, default 30) and the least
+        recently used ones beyond max_documents (XLIFF_MAX_DOCUMENTS, default 50) are deleted
+        when a new document is stored; 0 turns either limit off
+        """
+        self.path = path
+        self.retention_days = float(os.environ.get('XLIFF_RETENTION_DAYS', 30)) if retention_days is None else retention_days
+        self.max_documents = int(os.environ.get('XLIFF_MAX_DOCUMENTS', 50)) if max_documents is None else max_documents
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._cache: 'OrderedDict[str, LoadedDocument]' = OrderedDict()
+        # Held while a document is parsed, so concurrent loads parse it once without blocking other documents
+        self._parsing: Dict[str, threading.Lock] = {}
+        self._accessed: Dict[str, float] = {}
+
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        # Stores created before access times were tracked
+        if 'accessed_at' not in [column[1] for column in conn.execute('PRAGMA table_info(documents)')]:
+            try:
+                conn.execute('ALTER TABLE documents ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError:
+                pass  # Added by another worker starting at the same time
+
+    def _connection(self) -> sqlite3.Connection:
+        """Per-thread connection in autocommit mode (transactions are explicit)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def current_id(self) -> Optional[str]:
+        """Id of the most recently uploaded document"""
+        row = self._connection().execute(
+            "SELECT value FROM settings WHERE key = 'current_document'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def create_document(self, filename: str, content: bytes, is_xlz: bool = False,
+                        skeleton_files: Dict[str, bytes] = None) -> LoadedDocument:
+        """Store a new document, make it the current one and return its parsed copy"""
+        skeleton_files = skeleton_files or {}
+        doc_id = uuid.uuid4().hex
+
+        # Parse first so invalid files never reach the store
+        loaded = LoadedDocument(doc_id, filename, is_xlz, skeleton_files, content)
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            conn.execute(
+                'INSERT INTO documents (id, filename, is_xlz, content, version, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, 0, ?, ?)',
+                (doc_id, filename, int(is_xlz), content, now, now)
+            )
+            conn.executemany(
+                'INSERT INTO skeleton_files (doc_id, name, content) VALUES (?, ?, ?)',
+                [(doc_id, name, data) for name, data in skeleton_files.items()]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('current_document', ?)",
+                (doc_id,)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        with self._lock:
+            self._remember(loaded)
+            self._accessed[doc_id] = now
+        self.evict()
+        return loaded
+
+    def evict(self) -> List[str]:
+        """Delete expired documents and the least recently used ones beyond the limit; returns their ids"""
+        conn = self._connection()
+        rows = conn.execute(
+            'SELECT id, MAX(created_at, accessed_at) AS accessed FROM documents ORDER BY accessed DESC'
+        ).fetchall()
+        current = self.current_id()
+        cutoff = time.time() - self.retention_days * 86400
+
+        evicted = []
+        for rank, (doc_id, accessed) in enumerate(rows):
+            if doc_id == current:
+                continue
+            if (self.retention_days and accessed < cutoff) or (self.max_documents and rank >= self.max_documents):
+                self.delete_document(doc_id)
+                evicted.append(doc_id)
+        return evicted
+
+    def _touch(self, doc_id: str):
+        """Record an access, at most once per ACCESS_INTERVAL per worker"""
+        now = time.time()
+        with self._lock:
+            if now - self._accessed.get(doc_id, 0) < self.ACCESS_INTERVAL:
+                return
+            self._accessed[doc_id] = now
+        self._connection().execute('UPDATE documents SET accessed_at = ? WHERE id = ?', (now, doc_id))
+
+    def _remember(self, loaded: LoadedDocument):
+        self._cache[loaded.id] = loaded
+        self._cache.move_to_end(loaded.id)
+        while len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def load(self, doc_id: Optional[str] = None) -> LoadedDocument:
+        """Return the worker's parsed copy of a document, caught up with all stored edits"""
+        if doc_id is None:
+            doc_id = self.current_id()
+            if doc_id is None:
+                raise DocumentNotFound("No file uploaded")
+
+        conn = self._connection()
+        row = conn.execute('SELECT version FROM documents WHERE id = ?', (doc_id,)).fetchone()
+        if row is None:
+            with self._lock:
+                self._cache.pop(doc_id, None)
+            raise DocumentNotFound(f"Document {doc_id} not found")
+        stored_version = row[0]
+        self._touch(doc_id)
+
+        with self._lock:
+            loaded = self._cache.get(doc_id)
+            if loaded is not None:
+                self._remember(loaded)
+            else:
+                parsing = self._parsing.setdefault(doc_id, threading.Lock())
+
+        if loaded is None:
+            with parsing:
+                with self._lock:
+                    loaded = self._cache.get(doc_id)
+                if loaded is None:
+                    filename, is_xlz, content = conn.execute(
+                        'SELECT filename, is_xlz, content FROM documents WHERE id = ?', (doc_id,)
+                    ).fetchone()
+                    skeleton_files = dict(conn.execute(
+                        'SELECT name, content FROM skeleton_files WHERE doc_id = ?', (doc_id,)
+                    ))
+                    loaded = LoadedDocument(doc_id, filename, bool(is_xlz), skeleton_files, content)
+                    with self._lock:
+                        self._remember(loaded)
+                        self._parsing.pop(doc_id, None)
+
+        # Catching up only blocks readers of this document
+        if loaded.version < stored_version:
+            with loaded.lock.write():
+                if loaded.version < stored_version:
+                    edits = conn.execute(
+                        'SELECT kind, file_index, unit_id, payload, version, seq FROM unit_edits '
+                        'WHERE doc_id = ? AND seq > ? ORDER BY seq',
+                        (doc_id, loaded.version)
+                    ).fetchall()
+                    loaded.apply_edits([
+                        (kind, file_index, unit_id, json.loads(payload), version)
+                        for kind, file_index, unit_id, payload, version, seq in edits
+                    ])
+                    # Edits committed after the version check may be included already
+                    loaded.version = max([stored_version] + [edit[-1] for edit in edits])
+        return loaded
+
+    def record_edits(self, doc_id: str, edits: List[UnitEdit]) -> int:
+        """
+        Atomically store a batch of edits and return the new document version
+
+        Raises VersionConflict (and stores nothing) if any edit's expected_version
+        does not match the unit's stored version. An 'sdl-target' edit also bumps the
+        version of its trans-unit's 'target', recorded in its payload as unit_version.
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT version FROM documents WHERE id = ?', (doc_id,)).fetchone()
+            if row is None:
+                raise DocumentNotFound(f"Document {doc_id} not found")
+            seq = row[0]
+
+            for edit in edits:
+                if edit.expected_version is not None:
+                    current = conn.execute(
+                        'SELECT version FROM unit_edits WHERE doc_id = ? AND kind = ? AND file_index = ? AND unit_id = ?',
+                        (doc_id, edit.kind, edit.file_index, edit.unit_id)
+                    ).fetchone()
+                    current = current[0] if current else 0
+                    if current != edit.expected_version:
+                        raise VersionConflict(edit.kind, edit.file_index, edit.unit_id,
+                                              edit.expected_version, current)
+
+            rows = []
+            for edit in edits:
+                seq += 1
+                payload = edit.payload
+                if edit.kind == 'sdl-target':
+                    payload = dict(payload, unit_version=self._bump_target(
+                        conn, doc_id, edit.file_index, payload['trans_unit_id'], seq
+                    ))
+                rows.append((doc_id, edit.kind, edit.file_index, edit.unit_id, seq, json.dumps(payload)))
+
+            conn.executemany(
+                'INSERT INTO unit_edits (doc_id, kind, file_index, unit_id, version, seq, payload) '
+                'VALUES (?, ?, ?, ?, 1, ?, ?) '
+                'ON CONFLICT (doc_id, kind, file_index, unit_id) '
+                'DO UPDATE SET version = version + 1, seq = excluded.seq, payload = excluded.payload',
+                rows
+            )
+            conn.execute('UPDATE documents SET version = ?, accessed_at = ? WHERE id = ?', (seq, time.time(), doc_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        return seq
+
+    @staticmethod
+    def _bump_target(conn: sqlite3.Connection, doc_id: str, file_index: int, trans_unit_id: str, seq: int) -> int:
+        """Increment a trans-unit's 'target' version without replacing its stored target; returns the new version"""
+        row = conn.execute(
+            "SELECT version FROM unit_edits WHERE doc_id = ? AND kind = 'target' AND file_index = ? AND unit_id = ?",
+            (doc_id, file_index, trans_unit_id)
+        ).fetchone()
+        if row is None:
+            # A target-less row (payload null) that only carries the version
+            conn.execute(
+                "INSERT INTO unit_edits (doc_id, kind, file_index, unit_id, version, seq, payload) "
+                "VALUES (?, 'target', ?, ?, 1, ?, 'null')",
+                (doc_id, file_index, trans_unit_id, seq)
+            )
+            return 1
+        conn.execute(
+            "UPDATE unit_edits SET version = version + 1 WHERE doc_id = ? AND kind = 'target' AND file_index = ? AND unit_id = ?",
+            (doc_id, file_index, trans_unit_id)
+        )
+        return row[0] + 1
+
+    def delete_document(self, doc_id: str):
+        """Remove a document and its edits from the store"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM unit_edits WHERE doc_id = ?', (doc_id,))
+            conn.execute('DELETE FROM skeleton_files WHERE doc_id = ?', (doc_id,))
+            conn.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+            conn.execute(
+                "DELETE FROM settings WHERE key = 'current_document' AND value = ?", (doc_id,)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        with self._lock:
+            self._cache.pop(doc_id, None)
+            self._accessed.pop(doc_id, None)
+
+    def create_glossary(self, name: str, entries: List[GlossaryEntry], source_language: Optional[str] = None,
+                        target_language: Optional[str] = None, case_sensitive: bool = False,
+                        stemming: bool = False) -> GlossaryInfo:
+        """Compile and store a glossary"""
+        glossary = GlossaryCache.put(Glossary(entries, case_sensitive, stemming))
+        info = GlossaryInfo(
+            id=uuid.uuid4().hex,
+            name=name,
+            source_language=source_language,
+            target_language=target_language,
+            entries=len(entries),
+            case_sensitive=case_sensitive,
+            stemming=stemming
+        )
+        self._connection().execute(
+            'INSERT INTO glossaries (id, name, source_language, target_language, case_sensitive, stemming, '
+            'entry_count, content_hash, entries, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (info.id, name, source_language, target_language, int(case_sensitive), int(stemming),
+             len(entries), glossary.content_hash,
+             json.dumps([list(entry) for entry in entries], ensure_ascii=False), time.time())
+        )
+        return info
+
+    def list_glossaries(self) -> List[GlossaryInfo]:
+        rows = self._connection().execute(
+            'SELECT id, name, source_language, target_language, entry_count, case_sensitive, stemming '
+            'FROM glossaries ORDER BY created_at'
+        ).fetchall()
+        return [
+            GlossaryInfo(id=row[0], name=row[1], source_language=row[2], target_language=row[3],
+                         entries=row[4], case_sensitive=bool(row[5]), stemming=bool(row[6]))
+            for row in rows
+        ]
+
+    def load_glossary(self, glossary_id: str) -> Glossary:
+        """Compiled glossary; the automaton is only built if no worker cache holds it"""
+        conn = self._connection()
+        row = conn.execute('SELECT content_hash FROM glossaries WHERE id = ?', (glossary_id,)).fetchone()
+        if row is None:
+            raise GlossaryNotFound(f"Glossary {glossary_id} not found")
+
+        glossary = GlossaryCache.get(row[0])
+        if glossary is None:
+            entries, case_sensitive, stemming = conn.execute(
+                'SELECT entries, case_sensitive, stemming FROM glossaries WHERE id = ?', (glossary_id,)
+            ).fetchone()
+            glossary = GlossaryCache.put(Glossary(
+                [GlossaryEntry(source, targets) for source, targets in json.loads(entries)],
+                bool(case_sensitive),
+                bool(stemming)
+            ))
+        return glossary
+
+    def delete_glossary(self, glossary_id: str):
+        """Remove a glossary; this worker's documents drop its annotations (other workers' age out)"""
+        conn = self._connection()
+        row = conn.execute('SELECT content_hash FROM glossaries WHERE id = ?', (glossary_id,)).fetchone()
+        conn.execute('DELETE FROM glossaries WHERE id = ?', (glossary_id,))
+        if row is None or conn.execute('SELECT 1 FROM glossaries WHERE content_hash = ?', row).fetchone():
+            # Unknown, or the same terms are still stored under another id
+            return
+        with self._lock:
+            documents = list(self._cache.values())
+        for loaded in documents:
+            loaded.forget_glossary(row[0])
+
+def default_store_path() -> str:
+    """Database location, configurable through XLIFF_STORE_PATH"""
+    return os.environ.get(
+        'XLIFF_STORE_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xliff_store.db')
+    )
@@ -0,0 +1,337 @@
+"""
+Terminology matching against large glossaries
+
+Terms are split into words and compiled into a word-level Aho-Corasick
+automaton, so a segment is scanned once whatever the glossary size. Source
+hits are reported with character offsets in the segment text as parse_segment
+returns it (tag markers included); the target is scanned with a second
+automaton over the approved target terms to flag hits whose translation is
+missing. Built glossaries are cached by content hash.
+"""
+
+import codecs
+import csv
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from lxml import etree
+from models import SegmentTerms, TermHit
+from xliff_query import XliffQuery
+
+class GlossaryEntry(NamedTuple):
+    """A source term with its approved target terms"""
+    source: str
+    targets: List[str]
+
+class TermAutomaton:
+    """Aho-Corasick automaton over word sequences (patterns should be unique)"""
+
+    def __init__(self, patterns: List[Tuple[str, ...]]):
+        # Transitions as (state, word) -> state; state 0 is the root
+        self.goto: Dict[Tuple[int, str], int] = {}
+        self.fail: List[int] = [0]
+        # Patterns ending in each state (own and via failure links) as (pattern index, length)
+        output: List[List[Tuple[int, int]]] = [[]]
+        children: List[List[Tuple[str, int]]] = [[]]
+
+        for pattern_index, words in enumerate(patterns):
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                next_state = self.goto.get((state, word))
+                if next_state is None:
+                    next_state = len(self.fail)
+                    self.goto[(state, word)] = next_state
+                    self.fail.append(0)
+                    output.append([])
+                    children.append([])
+                    children[state].append((word, next_state))
+                state = next_state
+            output[state].append((pattern_index, len(words)))
+
+        # Failure links in breadth-first order (children of the root fail to the root)
+        queue = deque(child for _, child in children[0])
+        while queue:
+            state = queue.popleft()
+            for word, child in children[state]:
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and (fallback, word) not in self.goto:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto.get((fallback, word), 0)
+                output[child].extend(output[self.fail[child]])
+
+        self.output: List[Tuple[Tuple[int, int], ...]] = [tuple(matches) for matches in output]
+
+    def search(self, words: List[str]) -> Iterator[Tuple[int, int, int]]:
+        """Yield (first word, last word, pattern index) for every occurrence"""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for i, word in enumerate(words):
+            while state and (state, word) not in goto:
+                state = fail[state]
+            state = goto.get((state, word), 0)
+            for pattern_index, length in output[state]:
+                yield i - length + 1, i, pattern_index
+
+class Glossary:
+    """Compiled glossary: source and target automata plus matching options"""
+
+    # Words of a segment; tag markers are matched so they can be skipped
+    TOKEN = re.compile(r'⟨[^⟩]*⟩|\w+')
+
+    # Shortest stem left by suffix stripping
+    MIN_STEM = 3
+
+    def __init__(self, entries: List[GlossaryEntry], case_sensitive: bool = False, stemming: bool = False):
+        self.entries = entries
+        self.case_sensitive = case_sensitive
+        self.stemming = stemming
+        self.content_hash = Glossary.hash_entries(entries, case_sensitive, stemming)
+
+        # Each distinct (normalized) term is one pattern mapping back to its entries
+        self._source_entries: List[List[int]] = []
+        self._target_entries: List[List[int]] = []
+        self.source_automaton = self._compile(
+            ((entry_index, entry.source) for entry_index, entry in enumerate(entries)), self._source_entries)
+        self.target_automaton = self._compile(
+            ((entry_index, target) for entry_index, entry in enumerate(entries) for target in entry.targets),
+            self._target_entries)
+
+    def _compile(self, terms: Iterator[Tuple[int, str]], pattern_entries: List[List[int]]) -> TermAutomaton:
+        patterns: Dict[Tuple[str, ...], int] = {}
+        for entry_index, term in terms:
+            words = tuple(self.words(term))
+            if not words:
+                continue
+            pattern_index = patterns.get(words)
+            if pattern_index is None:
+                pattern_index = patterns[words] = len(pattern_entries)
+                pattern_entries.append([])
+            pattern_entries[pattern_index].append(entry_index)
+        return TermAutomaton(list(patterns))
+
+    @staticmethod
+    def hash_entries(entries: List[GlossaryEntry], case_sensitive: bool, stemming: bool) -> str:
+        """Content hash of a glossary and its matching options"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([case_sensitive, stemming]).encode('utf-8'))
+        for entry in entries:
+            digest.update(json.dumps([entry.source, entry.targets], ensure_ascii=False).encode('utf-8'))
+        return digest.hexdigest()
+
+    def stem(self, word: str) -> str:
+        """
+        Basic suffix stripping (plurals, -ing, -ed), then of a final e, so that
+        cache, caches, cached and caching (or box and boxes) share a stem
+        """
+        if word.endswith('ies') and len(word) > self.MIN_STEM + 2:
+            return word[:-3] + 'y'
+        if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            word = word[:-1]
+        elif word.endswith('ing') and len(word) - 3 >= self.MIN_STEM:
+            word = word[:-3]
+        elif word.endswith('ed') and len(word) - 2 >= self.MIN_STEM:
+            word = word[:-2]
+        if word.endswith('e') and len(word) - 1 >= self.MIN_STEM:
+            word = word[:-1]
+        return word
+
+    def normalize(self, word: str) -> str:
+        if not self.case_sensitive:
+            word = word.casefold()
+        if self.stemming:
+            word = self.stem(word)
+        return word
+
+    def tokenize(self, text: str) -> List[Tuple[str, int, int]]:
+        """Normalized words of a text with their character offsets (tag markers skipped)"""
+        return [(self.normalize(match.group()), match.start(), match.end())
+                for match in self.TOKEN.finditer(text) if not match.group().startswith('⟨')]
+
+    def words(self, term: str) -> List[str]:
+        return [word for word, _, _ in self.tokenize(term)]
+
+    def match(self, text: str) -> List[TermHit]:
+        """Glossary terms found in a source text, by position"""
+        tokens = self.tokenize(text)
+        hits = []
+        for first, last, pattern_index in self.source_automaton.search([word for word, _, _ in tokens]):
+            start = tokens[first][1]
+            end = tokens[last][2]
+            for entry_index in self._source_entries[pattern_index]:
+                entry = self.entries[entry_index]
+                hits.append(TermHit(
+                    start=start,
+                    end=end,
+                    text=text[start:end],
+                    term=entry.source,
+                    targets=entry.targets,
+                    entry_index=entry_index
+                ))
+        hits.sort(key=lambda hit: (hit.start, -hit.end))
+        return hits
+
+    def target_entries(self, text: str) -> set:
+        """Indexes of the entries whose approved target term occurs in a text"""
+        words = [word for word, _, _ in self.tokenize(text)]
+        return {entry_index
+                for _, _, pattern_index in self.target_automaton.search(words)
+                for entry_index in self._target_entries[pattern_index]}
+
+    def check(self, source_text: str, target_text: Optional[str]) -> Tuple[List[TermHit], List[str]]:
+        """
+        Source term hits with found_in_target set, plus the source terms whose
+        approved translation is missing from the target (none if there is no target)
+        """
+        hits = self.match(source_text)
+        if not hits or not target_text:
+            return hits, []
+
+        found = self.target_entries(target_text)
+        missing = []
+        for hit in hits:
+            hit.found_in_target = hit.entry_index in found or not hit.targets
+            if not hit.found_in_target and hit.term not in missing:
+                missing.append(hit.term)
+        return hits, missing
+
+    def annotate(self, file_index: int, trans_unit_id: str, source_text: str,
+                 target_text: Optional[str]) -> SegmentTerms:
+        hits, missing = self.check(source_text, target_text)
+        return SegmentTerms(file_index=file_index, trans_unit_id=trans_unit_id, hits=hits, missing=missing)
+
+class GlossaryCache:
+    """Compiled glossaries by content hash, shared by all documents of a worker"""
+
+    SIZE = 8
+
+    _glossaries: 'OrderedDict[str, Glossary]' = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, content_hash: str) -> Optional[Glossary]:
+        with cls._lock:
+            glossary = cls._glossaries.get(content_hash)
+            if glossary is not None:
+                cls._glossaries.move_to_end(content_hash)
+            return glossary
+
+    @classmethod
+    def put(cls, glossary: Glossary) -> Glossary:
+        with cls._lock:
+            cls._glossaries[glossary.content_hash] = glossary
+            cls._glossaries.move_to_end(glossary.content_hash)
+            while len(cls._glossaries) > cls.SIZE:
+                cls._glossaries.popitem(last=False)
+        return glossary
+
+class GlossaryReader:
+    """Readers for TBX and TSV term lists"""
+
+    @staticmethod
+    def read(fileobj: BinaryIO, filename: str, source_language: Optional[str] = None,
+             target_language: Optional[str] = None) -> Tuple[List[GlossaryEntry], Optional[str], Optional[str]]:
+        """Read entries and return them with the source and target languages used"""
+        name = filename.lower()
+        if name.endswith('.tbx'):
+            return GlossaryReader.read_tbx(fileobj, source_language, target_language)
+        if name.endswith(('.tsv', '.tab', '.txt')):
+            return GlossaryReader.read_tsv(fileobj, source_language, target_language)
+        raise ValueError("Glossary must be TBX (.tbx) or TSV (.tsv)")
+
+    @staticmethod
+    def _language_matches(code: Optional[str], wanted: Optional[str]) -> bool:
+        """Exact match, or same primary language (en matches en-US)"""
+        if not code or not wanted:
+            return False
+        code = code.lower().replace('_', '-')
+        wanted = wanted.lower().replace('_', '-')
+        return code == wanted or code.split('-')[0] == wanted.split('-')[0]
+
+    @staticmethod
+    def read_tbx(fileobj: BinaryIO, source_language: Optional[str] = None,
+                 target_language: Optional[str] = None) -> Tuple[List[GlossaryEntry], Optional[str], Optional[str]]:
+        """
+        Read TBX (termEntry/langSet/tig/term or TBX v3 conceptEntry/langSec/termSec/term)
+        Without languages, the first two languages of the first entry are used
+        """
+        lang_attr = '{http://www.w3.org/XML/1998/namespace}lang'
+        entries = []
+        for _, concept in etree.iterparse(fileobj, events=('end',), tag=('{*}termEntry', '{*}conceptEntry'),
+                                          huge_tree=True):
+            terms: List[Tuple[str, List[str]]] = []
+            for lang_elem in concept:
+                if not isinstance(lang_elem.tag, str) or etree.QName(lang_elem).localname not in ('langSet', 'langSec'):
+                    continue
+                language = lang_elem.get(lang_attr) or lang_elem.get('lang')
+                texts = [''.join(term.itertext()).strip() for term in lang_elem.iter('{*}term')]
+                terms.append((language, [text for text in texts if text]))
+
+            if source_language is None and len(terms) >= 2:
+                source_language = terms[0][0]
+                target_language = target_language or terms[1][0]
+
+            sources = [text for language, texts in terms
+                       if GlossaryReader._language_matches(language, source_language) for text in texts]
+            targets = [text for language, texts in terms
+                       if GlossaryReader._language_matches(language, target_language) for text in texts]
+            for source in sources:
+                entries.append(GlossaryEntry(source, targets))
+
+            XliffQuery.release(concept)
+
+        return entries, source_language, target_language
+
+    @staticmethod
+    def read_tsv(fileobj: BinaryIO, source_language: Optional[str] = None,
+                 target_language: Optional[str] = None) -> Tuple[List[GlossaryEntry], Optional[str], Optional[str]]:
+        """
+        Read a TSV with a header naming the 'source' and 'target' columns (or the languages),
+        or a header-less file of source<TAB>target rows; synonyms are separated by ';'
+        """
+        lines = codecs.getreader('utf-8-sig')(fileobj)
+        rows = csv.reader(lines, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+        header = next(rows, None)
+        if header is None:
+            return [], source_language, target_language
+        names = [name.strip() for name in header]
+
+        def column(name: str, language: Optional[str]) -> Optional[int]:
+            for i, column_name in enumerate(names):
+                if column_name.lower() == name:
+                    return i
+            for i, column_name in enumerate(names):
+                if GlossaryReader._language_matches(column_name, language):
+                    return i
+            return None
+
+        source_index = column('source', source_language)
+        target_index = column('target', target_language)
+        if source_index is None or target_index is None or source_index == target_index:
+            # No header: the first row is data
+            source_index, target_index = 0, 1
+            data_rows = [header]
+        else:
+            data_rows = []
+            if names[source_index].lower() != 'source':
+                source_language = source_language or names[source_index]
+            if names[target_index].lower() != 'target':
+                target_language = target_language or names[target_index]
+
+        entries = []
+        for source_rows in (data_rows, rows):
+            for row in source_rows:
+                if len(row) <= source_index or not row[source_index].strip():
+                    continue
+                targets = row[target_index].split(';') if len(row) > target_index else []
+                entries.append(GlossaryEntry(row[source_index].strip(),
+                                             [target.strip() for target in targets if target.strip()]))
+        return entries, source_language, target_language
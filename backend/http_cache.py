@@ -0,0 +1,123 @@
+"""
+Conditional requests and response compression for document endpoints
+
+Responses about a document carry an ETag built from the document id and its
+version, which the store increments on every edit. A request whose
+If-None-Match matches gets an empty 304. Bodies are compressed with zstd
+(when the optional zstandard package is installed) or gzip, following the
+client's Accept-Encoding.
+"""
+
+import gzip
+import json
+from typing import Callable, Dict, Optional
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+try:
+    import zstandard
+except ImportError:  # Optional, gzip is used without it
+    zstandard = None
+
+class HttpCache:
+    """ETag, If-None-Match and Accept-Encoding handling"""
+
+    # Bodies smaller than this are sent uncompressed
+    MIN_COMPRESS_SIZE = 1024
+
+    GZIP_LEVEL = 6
+    ZSTD_LEVEL = 3
+
+    @staticmethod
+    def etag(doc_id: str, version: int, variant: str = '') -> str:
+        """Weak ETag of a document version (the same for every content encoding)"""
+        return f'W/"{doc_id}-{version}{"-" + variant if variant else ""}"'
+
+    @staticmethod
+    def not_modified(request: Request, etag: str) -> bool:
+        """True if the client's If-None-Match matches the ETag (weak comparison)"""
+        header = request.headers.get('if-none-match')
+        if not header:
+            return False
+        opaque = etag[2:] if etag.startswith('W/') else etag
+        for candidate in header.split(','):
+            candidate = candidate.strip()
+            if candidate == '*':
+                return True
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == opaque:
+                return True
+        return False
+
+    @staticmethod
+    def encodings() -> Dict[str, Callable[[bytes], bytes]]:
+        """Supported content encodings, preferred first"""
+        available = {}
+        if zstandard is not None:
+            available['zstd'] = lambda body: zstandard.ZstdCompressor(level=HttpCache.ZSTD_LEVEL).compress(body)
+        available['gzip'] = lambda body: gzip.compress(body, compresslevel=HttpCache.GZIP_LEVEL, mtime=0)
+        return available
+
+    @staticmethod
+    def negotiate(request: Request) -> Optional[str]:
+        """Best content encoding accepted by the client, or None for identity"""
+        accepted = {}
+        for item in request.headers.get('accept-encoding', '').split(','):
+            name, _, params = item.strip().partition(';')
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                accepted[name.strip().lower()] = quality
+
+        best = None
+        best_quality = 0.0
+        for encoding in HttpCache.encodings():
+            quality = accepted.get(encoding, accepted.get('*', 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    @staticmethod
+    def compress(body: bytes, encoding: Optional[str]) -> bytes:
+        if encoding is None:
+            return body
+        return HttpCache.encodings()[encoding](body)
+
+    @staticmethod
+    def headers(etag: str, encoding: Optional[str] = None) -> Dict[str, str]:
+        headers = {
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+            # Let clients keep the body but revalidate it on every use
+            'Cache-Control': 'no-cache',
+        }
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return headers
+
+    @staticmethod
+    def not_modified_response(etag: str) -> Response:
+        return Response(status_code=304, headers=HttpCache.headers(etag))
+
+    @staticmethod
+    def json_response(request: Request, etag: str, build: Callable[[], object]) -> Response:
+        """
+        JSON response for the given ETag; build() is only called when the client's copy is stale
+        """
+        if HttpCache.not_modified(request, etag):
+            return HttpCache.not_modified_response(etag)
+
+        body = json.dumps(jsonable_encoder(build()), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        encoding = HttpCache.negotiate(request) if len(body) >= HttpCache.MIN_COMPRESS_SIZE else None
+        return Response(
+            content=HttpCache.compress(body, encoding),
+            media_type='application/json',
+            headers=HttpCache.headers(etag, encoding)
+        )
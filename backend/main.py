@@ -1,9 +1,22 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from models import XliffDocument, TransUnitUpdate
-from xliff_parser import XliffParser
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from models import (XliffDocument, TransUnitUpdate, SegmentQuery, SegmentQueryResult,
+                    SdlSegment, SdlSegmentUpdate, SdlStatusUpdate, MergeReport, DiffResult,
+                    PretranslateRequest, PretranslateReport, GlossaryInfo, SegmentTerms, TermCheckRequest, TransUnit)
+from document_store import (DocumentStore, LoadedDocument, UnitEdit, DocumentNotFound, GlossaryNotFound,
+                            VersionConflict, default_store_path)
 from xlz_handler import XLZHandler
+from sdlxliff_handler import SdlXliffHandler
+from bilingual_export import BilingualExporter
+from bilingual_merge import BilingualReader, BilingualMerger
+from xliff_diff import XliffDiff
+from pretranslate import PreTranslator, PretranslateItem, get_provider
+from glossary import Glossary, GlossaryReader
+from http_cache import HttpCache
+from typing import List, Optional, Tuple
 from lxml import etree
 import io
 
@@ -16,11 +29,60 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "ETag"],
 )
 
-# Store the current XML tree and skeleton files in memory
-current_file_store = {}
+# Compress other large responses (document JSON, exports); responses that are
+# already encoded (cached downloads, ETag endpoints) are passed through
+app.add_middleware(GZipMiddleware, minimum_size=HttpCache.MIN_COMPRESS_SIZE)
+
+# Documents are kept in a store shared by all worker processes
+document_store = DocumentStore(default_store_path())
+
+def get_document(document_id: Optional[str] = None) -> LoadedDocument:
+    """Resolve the requested document (defaults to the most recent upload)"""
+    try:
+        return document_store.load(document_id)
+    except DocumentNotFound as e:
+        status_code = 400 if document_id is None else 404
+        raise HTTPException(status_code=status_code, detail=str(e))
+
+def get_glossary(glossary_id: str) -> Glossary:
+    """Resolve a stored glossary (compiled once per worker)"""
+    try:
+        return document_store.load_glossary(glossary_id)
+    except GlossaryNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def record_edits(loaded: LoadedDocument, edits: List[UnitEdit]) -> LoadedDocument:
+    """Store edits and return the document caught up with them"""
+    try:
+        document_store.record_edits(loaded.id, edits)
+    except VersionConflict as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "current_version": e.current})
+    except DocumentNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    return get_document(loaded.id)
+
+def record_unconflicting_edits(loaded: LoadedDocument, edits: List[UnitEdit]) -> Tuple[LoadedDocument, int]:
+    """
+    Store edits that carry expected versions, leaving out units that changed in the meantime
+    Returns the caught-up document and the number of edits left out
+    """
+    conflicting = 0
+    while edits:
+        try:
+            document_store.record_edits(loaded.id, edits)
+            break
+        except VersionConflict as e:
+            # The batch was rolled back; retry without the unit that changed
+            edits = [edit for edit in edits if (edit.kind, edit.file_index, edit.unit_id) != (e.kind, e.file_index, e.unit_id)]
+            conflicting += 1
+        except DocumentNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    
+    return get_document(loaded.id), conflicting
 
 @app.get("/")
 async def root():
@@ -44,11 +106,8 @@ async def upload_xliff(file: UploadFile = File(...)):
         # Handle XLZ files
         if XLZHandler.is_xlz_file(filename):
             try:
-                xliff_content, skeleton_files = XLZHandler.extract_xliff_from_xlz(content)
-                
-                # Store skeleton files for later download
-                current_file_store['skeleton_files'] = skeleton_files
-                current_file_store['is_xlz'] = True
+                xliff_content, skeleton_files = await run_in_threadpool(XLZHandler.extract_xliff_from_xlz, content)
+                is_xlz = True
                 
                 # Use extracted XLIFF content
                 content = xliff_content
@@ -56,115 +115,518 @@ async def upload_xliff(file: UploadFile = File(...)):
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Error extracting XLZ: {str(e)}")
         else:
-            current_file_store['is_xlz'] = False
-            current_file_store['skeleton_files'] = {}
-        
-        # Store the original XML tree for later updates
-        tree = etree.fromstring(content)
-        current_file_store['tree'] = tree
-        current_file_store['filename'] = file.filename  # Store original filename with correct case
+            is_xlz = False
+            skeleton_files = {}
         
-        # Parse and return structured data
-        document = XliffParser.parse_file(content)
-        return document
+        # Store the original content (and skeleton files for later download);
+        # the store parses it and builds the segment indexes, off the event loop
+        loaded = await run_in_threadpool(
+            document_store.create_document,
+            file.filename,  # Store original filename with correct case
+            content,
+            is_xlz=is_xlz,
+            skeleton_files=skeleton_files
+        )
+        return await run_in_threadpool(loaded.snapshot)
         
+    except HTTPException:
+        raise
     except etree.XMLSyntaxError as e:
         raise HTTPException(status_code=400, detail=f"Invalid XLIFF XML: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error parsing file: {str(e)}")
 
+@app.get("/document", response_model=XliffDocument)
+def get_document_model(request: Request, loaded: LoadedDocument = Depends(get_document)):
+    """The document with current targets and unit versions (to refresh after a conflict, merge or pre-translation)"""
+    return HttpCache.json_response(request, HttpCache.etag(loaded.id, loaded.version), loaded.snapshot)
+
+@app.get("/trans-unit/{file_index}/{trans_unit_id}", response_model=TransUnit)
+def get_trans_unit(file_index: int, trans_unit_id: str, loaded: LoadedDocument = Depends(get_document)):
+    """One trans-unit with its current target and version"""
+    with loaded.lock.read():
+        position = loaded.index.locate(file_index, trans_unit_id)
+        if position is None:
+            raise HTTPException(status_code=404, detail=f"Trans-unit {trans_unit_id} not found")
+        return loaded.document.files[file_index].trans_units[position]
+
 @app.get("/xlz/info")
-async def get_xlz_info():
+def get_xlz_info(request: Request, loaded: LoadedDocument = Depends(get_document)):
     """Get information about the currently loaded XLZ file"""
-    if 'tree' not in current_file_store:
-        raise HTTPException(status_code=400, detail="No file uploaded")
+    return HttpCache.json_response(request, HttpCache.etag(loaded.id, loaded.version), lambda: {
+        "document_id": loaded.id,
+        "is_xlz": loaded.is_xlz,
+        "filename": loaded.filename,
+        "skeleton_files": list(loaded.skeleton_files.keys())
+    })
+
+@app.put("/trans-unit")
+def update_trans_unit(update: TransUnitUpdate, loaded: LoadedDocument = Depends(get_document)):
+    """Update a trans-unit's target translation"""
+    if loaded.index.locate(update.file_index, update.trans_unit_id) is None:
+        raise HTTPException(status_code=404, detail=f"Trans-unit {update.trans_unit_id} not found")
+    
+    edit = UnitEdit(
+        kind='target',
+        file_index=update.file_index,
+        unit_id=update.trans_unit_id,
+        payload={
+            'target_text': update.target_text,
+            'target_tags': [tag.model_dump() for tag in update.target_tags]
+        },
+        expected_version=update.expected_version
+    )
+    
+    # Catch up with the store, which applies this edit (and any concurrent ones)
+    loaded = record_edits(loaded, [edit])
     
     return {
-        "is_xlz": current_file_store.get('is_xlz', False),
-        "filename": current_file_store.get('filename'),
-        "skeleton_files": list(current_file_store.get('skeleton_files', {}).keys())
+        "message": "Trans-unit updated successfully",
+        "version": loaded.unit_version('target', update.file_index, update.trans_unit_id),
+        "document_version": loaded.version
     }
 
-@app.put("/trans-unit")
-async def update_trans_unit(update: TransUnitUpdate):
-    """Update a trans-unit's target translation"""
-    if 'tree' not in current_file_store:
-        raise HTTPException(status_code=400, detail="No file uploaded")
+@app.post("/segments/query", response_model=SegmentQueryResult)
+def query_segments(query: SegmentQuery, loaded: LoadedDocument = Depends(get_document)):
+    """Filter and sort trans-units through the segment indexes, returning a page of ids"""
+    try:
+        with loaded.lock.read():
+            return loaded.index.query(query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/sdl/segments", response_model=List[SdlSegment])
+def list_sdl_segments(request: Request, conf: Optional[str] = None, locked: Optional[bool] = None,
+                      offset: int = 0, limit: int = 100,
+                      loaded: LoadedDocument = Depends(get_document)):
+    """List SDLXLIFF sub-segments with their confirmation status (without content)"""
+    def build():
+        sdl = loaded.sdl
+        keys = sdl.select(conf=conf, locked=locked)[max(offset, 0):max(offset, 0) + max(limit, 0)]
+        
+        segments = []
+        for file_index, mid in keys:
+            status = sdl.status(file_index, mid)
+            segments.append(SdlSegment(
+                mid=mid,
+                file_index=file_index,
+                trans_unit_id=sdl.trans_units[(file_index, mid)].get('id'),
+                conf=status['conf'],
+                locked=status['locked'],
+                origin=status['origin'],
+                version=loaded.unit_version('sdl-target', file_index, mid),
+                status_version=loaded.unit_version('sdl-status', file_index, mid)
+            ))
+        return segments
+    
+    with loaded.lock.read():
+        return HttpCache.json_response(request, HttpCache.etag(loaded.id, loaded.version), build)
+
+def sdl_segments(loaded: LoadedDocument, file_index: int, trans_unit_id: str) -> List[SdlSegment]:
+    """Sub-segments of a trans-unit with their versions (the caller holds the read lock)"""
+    tu_elem = loaded.trans_unit_element(file_index, trans_unit_id)
+    if tu_elem is None:
+        return []
+    segments = SdlXliffHandler.parse_segments(tu_elem, file_index, loaded.sdl)
+    for segment in segments:
+        segment.version = loaded.unit_version('sdl-target', file_index, segment.mid)
+        segment.status_version = loaded.unit_version('sdl-status', file_index, segment.mid)
+    return segments
+
+@app.get("/sdl/trans-unit/{file_index}/{trans_unit_id}/segments", response_model=List[SdlSegment])
+def get_sdl_segments(request: Request, file_index: int, trans_unit_id: str,
+                     loaded: LoadedDocument = Depends(get_document)):
+    """Parse the sub-segments of one trans-unit on request"""
+    if loaded.index.locate(file_index, trans_unit_id) is None:
+        raise HTTPException(status_code=404, detail=f"Trans-unit {trans_unit_id} not found")
+    
+    with loaded.lock.read():
+        return HttpCache.json_response(request, HttpCache.etag(loaded.id, loaded.version),
+                                       lambda: sdl_segments(loaded, file_index, trans_unit_id))
+
+@app.put("/sdl/segment")
+def update_sdl_segment(update: SdlSegmentUpdate, loaded: LoadedDocument = Depends(get_document)):
+    """Update the target of one SDLXLIFF sub-segment (and optionally its confirmation level)"""
+    position = loaded.index.locate(update.file_index, update.trans_unit_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail=f"Trans-unit {update.trans_unit_id} not found")
+    if update.mid not in loaded.document.files[update.file_index].trans_units[position].segment_ids:
+        raise HTTPException(status_code=404, detail=f"Segment {update.mid} not found in trans-unit {update.trans_unit_id}")
+    
+    edits = [UnitEdit(
+        kind='sdl-target',
+        file_index=update.file_index,
+        unit_id=update.mid,
+        payload={
+            'trans_unit_id': update.trans_unit_id,
+            'target_text': update.target_text,
+            'target_tags': [tag.model_dump() for tag in update.target_tags]
+        },
+        expected_version=update.expected_version
+    )]
+    
+    status = loaded.sdl.status(update.file_index, update.mid)
+    if update.conf is not None and status is not None:
+        edits.append(UnitEdit(
+            kind='sdl-status',
+            file_index=update.file_index,
+            unit_id=update.mid,
+            payload={'conf': update.conf, 'locked': status['locked']}
+        ))
+    
+    loaded = record_edits(loaded, edits)
+    return {
+        "message": "Segment updated successfully",
+        "version": loaded.unit_version('sdl-target', update.file_index, update.mid),
+        "status_version": loaded.unit_version('sdl-status', update.file_index, update.mid),
+        "trans_unit_version": loaded.unit_version('target', update.file_index, update.trans_unit_id),
+        "document_version": loaded.version
+    }
+
+@app.put("/sdl/segment/status")
+def update_sdl_segment_status(update: SdlStatusUpdate, loaded: LoadedDocument = Depends(get_document)):
+    """Update the confirmation level and/or lock of one SDLXLIFF sub-segment"""
+    status = loaded.sdl.status(update.file_index, update.mid)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Segment definition {update.mid} not found")
+    
+    edit = UnitEdit(
+        kind='sdl-status',
+        file_index=update.file_index,
+        unit_id=update.mid,
+        payload={
+            'conf': update.conf if update.conf is not None else status['conf'],
+            'locked': update.locked if update.locked is not None else status['locked']
+        },
+        expected_version=update.expected_version
+    )
+    
+    loaded = record_edits(loaded, [edit])
+    return {
+        "message": "Segment status updated successfully",
+        "status_version": loaded.unit_version('sdl-status', update.file_index, update.mid),
+        "document_version": loaded.version
+    }
+
+@app.post("/merge", response_model=MergeReport)
+def merge_bilingual(file: UploadFile = File(...), overwrite: bool = Form(False),
+                    match_by_source: bool = Form(True), state: Optional[str] = Form(None),
+                    loaded: LoadedDocument = Depends(get_document)):
+    """Merge targets from an XLIFF, TMX, TSV or JSON Lines file into the loaded document"""
+    source_language = loaded.document.files[0].source_language if loaded.document.files else None
+    
+    def segments(file_index: int, trans_unit: TransUnit) -> List[SdlSegment]:
+        with loaded.lock.read():
+            return sdl_segments(loaded, file_index, trans_unit.id)
     
     try:
-        updated_xml = XliffParser.update_trans_unit(
-            current_file_store['tree'],
-            update.file_index,
-            update.trans_unit_id,
-            update.target_text,
-            update.target_tags
+        records = BilingualReader.read(file.file, file.filename or '', source_language)
+        targets, report = BilingualMerger(loaded.snapshot(), segments).merge(
+            records,
+            overwrite=overwrite,
+            match_by_source=match_by_source
         )
-        
-        # Update stored tree
-        current_file_store['tree'] = etree.fromstring(updated_xml)
-        
-        return {"message": "Trans-unit updated successfully"}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating trans-unit: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except etree.XMLSyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid XML: {str(e)}")
+    
+    edits = []
+    for (file_index, trans_unit_id, mid), target in targets.items():
+        payload = {
+            'target_text': target.text,
+            'target_tags': [tag.model_dump() for tag in target.tags]
+        }
+        if mid is not None:
+            # SDLXLIFF sub-segments are written into their own <mrk> of the target
+            payload['trans_unit_id'] = trans_unit_id
+            edits.append(UnitEdit(kind='sdl-target', file_index=file_index, unit_id=mid, payload=payload))
+            continue
+        if state is not None:
+            payload['state'] = state
+        edits.append(UnitEdit(kind='target', file_index=file_index, unit_id=trans_unit_id, payload=payload))
+    
+    if edits:
+        loaded = record_edits(loaded, edits)
+    report.document_version = loaded.version
+    return report
 
-@app.get("/download")
-async def download_xliff():
-    """Download the modified XLIFF file with original filename and extension"""
-    if 'tree' not in current_file_store:
-        raise HTTPException(status_code=400, detail="No file to download")
+def collect_pretranslation(loaded: LoadedDocument, file_index: Optional[int], overwrite: bool) -> List[PretranslateItem]:
+    """Pre-translation candidates; SDLXLIFF units are collected sub-segment by sub-segment"""
+    with loaded.lock.read():
+        return PreTranslator.collect(
+            loaded.document, file_index, overwrite,
+            lambda file_index, trans_unit: sdl_segments(loaded, file_index, trans_unit.id)
+        )
+
+@app.post("/pretranslate", response_model=PretranslateReport)
+async def pretranslate(request: PretranslateRequest, loaded: LoadedDocument = Depends(get_document)):
+    """Fill empty targets from a translation provider, in batches, and store them in one bulk edit"""
+    if request.file_index is not None and not 0 <= request.file_index < len(loaded.document.files):
+        raise HTTPException(status_code=404, detail=f"File {request.file_index} not found")
+    if request.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be >= 1")
     
     try:
-        xml_content = etree.tostring(
-            current_file_store['tree'],
-            encoding='utf-8',
-            xml_declaration=True,
-            pretty_print=True
+        provider = get_provider(request.provider)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    translator = PreTranslator(provider, max_batch_chars=request.max_batch_chars, concurrency=request.concurrency)
+    # Store and tree access blocks, so it runs in the threadpool rather than on the event loop
+    items = await run_in_threadpool(collect_pretranslation, loaded, request.file_index, request.overwrite)
+    report = PretranslateReport(provider=provider.name)
+    targets = await translator.run(loaded.document, items, report)
+    
+    # Leave units alone that were edited while the provider was working: known ones are
+    # dropped here, the store rejects any edited since (expected_version)
+    loaded = await run_in_threadpool(get_document, loaded.id)
+    edits = []
+    for item in items:
+        target = targets.get((item.file_index, item.trans_unit_id, item.mid))
+        if target is None:
+            continue
+        payload = {
+            'target_text': target.text,
+            'target_tags': [tag.model_dump() for tag in target.tags]
+        }
+        if item.mid is not None:
+            # SDLXLIFF sub-segments are written into their own <mrk> of the target
+            kind, unit_id = 'sdl-target', item.mid
+            payload['trans_unit_id'] = item.trans_unit_id
+        else:
+            kind, unit_id = 'target', item.trans_unit_id
+            if request.state is not None:
+                payload['state'] = request.state
+        if loaded.unit_version(kind, item.file_index, unit_id) != item.version:
+            report.skipped += 1
+            continue
+        edits.append(UnitEdit(kind=kind, file_index=item.file_index, unit_id=unit_id, payload=payload,
+                              expected_version=item.version))
+    
+    loaded, conflicting = await run_in_threadpool(record_unconflicting_edits, loaded, edits)
+    report.skipped += conflicting
+    report.translated = len(edits) - conflicting
+    report.document_version = loaded.version
+    return report
+
+@app.post("/glossaries", response_model=GlossaryInfo)
+def upload_glossary(file: UploadFile = File(...), name: Optional[str] = Form(None),
+                    source_language: Optional[str] = Form(None), target_language: Optional[str] = Form(None),
+                    case_sensitive: bool = Form(False), stemming: bool = Form(False)):
+    """Upload a TBX or TSV term list"""
+    try:
+        entries, source_language, target_language = GlossaryReader.read(
+            file.file, file.filename or '', source_language, target_language)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except etree.XMLSyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid TBX XML: {str(e)}")
+    
+    if not entries:
+        raise HTTPException(status_code=400, detail="No terms found for the given languages")
+    
+    info = document_store.create_glossary(
+        name or file.filename or 'glossary',
+        entries,
+        source_language=source_language,
+        target_language=target_language,
+        case_sensitive=case_sensitive,
+        stemming=stemming
+    )
+    
+    # Annotate the loaded document now rather than on the first /terms request
+    if document_store.current_id() is not None:
+        loaded = get_document()
+        with loaded.lock.read():
+            loaded.term_annotations(get_glossary(info.id))
+    return info
+
+@app.get("/glossaries", response_model=List[GlossaryInfo])
+def list_glossaries():
+    return document_store.list_glossaries()
+
+@app.delete("/glossaries/{glossary_id}")
+def delete_glossary(glossary_id: str):
+    document_store.delete_glossary(glossary_id)
+    return {"message": "Glossary deleted"}
+
+@app.post("/glossaries/{glossary_id}/check", response_model=SegmentTerms)
+def check_terms(glossary_id: str, request: TermCheckRequest):
+    """Find glossary terms in any source text and check the target for their translations"""
+    hits, missing = get_glossary(glossary_id).check(request.source, request.target)
+    return SegmentTerms(hits=hits, missing=missing)
+
+@app.get("/terms", response_model=List[SegmentTerms])
+def document_terms(request: Request, glossary_id: str, missing_only: bool = False, offset: int = 0,
+                   limit: Optional[int] = None, loaded: LoadedDocument = Depends(get_document)):
+    """Glossary hits of all trans-units that contain a term, in document order"""
+    glossary = get_glossary(glossary_id)
+    
+    def build():
+        annotations = loaded.term_annotations(glossary)
+        results = [
+            terms for terms in annotations.values()
+            if terms.hits and (terms.missing or not missing_only)
+        ]
+        end = None if limit is None else offset + limit
+        return results[offset:end]
+    
+    with loaded.lock.read():
+        return HttpCache.json_response(request, HttpCache.etag(loaded.id, loaded.version, glossary.content_hash), build)
+
+@app.get("/terms/{file_index}/{trans_unit_id}", response_model=SegmentTerms)
+def trans_unit_terms(request: Request, file_index: int, trans_unit_id: str, glossary_id: str,
+                     loaded: LoadedDocument = Depends(get_document)):
+    """Glossary hits of one trans-unit"""
+    position = loaded.index.locate(file_index, trans_unit_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail=f"Trans-unit {trans_unit_id} not found")
+    
+    glossary = get_glossary(glossary_id)
+    with loaded.lock.read():
+        trans_unit = loaded.document.files[file_index].trans_units[position]
+        etag = HttpCache.etag(loaded.id, loaded.version, glossary.content_hash)
+    return HttpCache.json_response(
+        request,
+        etag,
+        lambda: glossary.annotate(
+            file_index,
+            trans_unit_id,
+            trans_unit.source.text,
+            trans_unit.target.text if trans_unit.target else None
         )
+    )
+
+def diff_side(file: Optional[UploadFile], document_id: Optional[str]):
+    """Trans-unit stream of an uploaded file or of a stored document"""
+    if file is not None:
+        if XLZHandler.is_xlz_file(file.filename or ''):
+            try:
+                content, _ = XLZHandler.extract_xliff_from_xlz(file.file.read())
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Error extracting XLZ: {str(e)}")
+            return XliffDiff.iter_stream(io.BytesIO(content))
+        return XliffDiff.iter_stream(file.file)
+    # Copies read chunk by chunk, so the diff doesn't hold the lock or see half-applied edits
+    loaded = get_document(document_id)
+    with loaded.lock.read():
+        return XliffDiff.iter_tree(loaded.tree, loaded.iter_trans_units())
+
+@app.post("/diff", response_model=DiffResult)
+def diff_documents(base_file: Optional[UploadFile] = File(None), base_document_id: Optional[str] = Form(None),
+                   other_file: Optional[UploadFile] = File(None), other_document_id: Optional[str] = Form(None),
+                   text_diff: bool = Form(True), offset: int = Form(0), limit: Optional[int] = Form(100)):
+    """
+    Compare two XLIFF versions (uploaded or stored) by file original and trans-unit id
+    The base must be given; the other side defaults to the loaded document
+    """
+    if base_file is None and base_document_id is None:
+        raise HTTPException(status_code=400, detail="Provide base_file or base_document_id")
+    if offset < 0 or (limit is not None and limit < 1):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    
+    try:
+        result = XliffDiff.diff(
+            diff_side(base_file, base_document_id),
+            diff_side(other_file, other_document_id),
+            with_text_diff=text_diff
+        )
+    except etree.XMLSyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid XLIFF XML: {str(e)}")
+    
+    end = None if limit is None else offset + limit
+    result.changes = result.changes[offset:end]
+    result.offset = offset
+    result.limit = limit
+    return result
+
+def serialize_download(loaded: LoadedDocument) -> bytes:
+    """The document as it is downloaded: XLIFF, or an XLZ archive with the skeleton files"""
+    # Only the regions edited since the previous download are serialized again
+    xml_content = loaded.serializer.serialize()
+    
+    # If original was XLZ, recreate XLZ with skeleton files
+    if loaded.is_xlz:
+        return XLZHandler.create_xlz_archive(xml_content, loaded.skeleton_files)
+    return xml_content
+
+@app.get("/download")
+def download_xliff(request: Request, loaded: LoadedDocument = Depends(get_document)):
+    """Download the modified XLIFF file with original filename and extension"""
+    # Get original filename (preserves case and extension)
+    filename = loaded.filename or 'modified.xliff'
+    
+    if loaded.is_xlz:
+        media_type = 'application/zip'
+        # Ensure .xlz extension
+        if not filename.lower().endswith('.xlz'):
+            filename = filename.rsplit('.', 1)[0] + '.xlz'
+    elif filename.lower().endswith('.sdlxliff'):
+        # Media type based on extension
+        media_type = 'application/x-sdlxliff+xml'
+    else:
+        media_type = 'application/x-xliff+xml'
+    
+    with loaded.lock.read():
+        etag = HttpCache.etag(loaded.id, loaded.version)
+        if HttpCache.not_modified(request, etag):
+            return HttpCache.not_modified_response(etag)
         
-        # Get original filename (preserves case and extension)
-        filename = current_file_store.get('filename', 'modified.xliff')
-        
-        # If original was XLZ, recreate XLZ with skeleton files
-        if current_file_store.get('is_xlz', False):
-            skeleton_files = current_file_store.get('skeleton_files', {})
-            xlz_content = XLZHandler.create_xlz_archive(xml_content, skeleton_files)
-            
-            # Ensure .xlz extension
-            if not filename.lower().endswith('.xlz'):
-                filename = filename.rsplit('.', 1)[0] + '.xlz'
+        try:
+            # Serialized (and compressed) bodies are kept until the next edit
+            content = loaded.cached_download(None, lambda: serialize_download(loaded))
             
-            return Response(
-                content=xlz_content,
-                media_type='application/zip',
-                headers={
-                    'Content-Disposition': f'attachment; filename="{filename}"'
-                }
+            # XLZ archives are already compressed
+            encoding = None if loaded.is_xlz else HttpCache.negotiate(request)
+            if encoding is not None:
+                content = loaded.cached_download(encoding, lambda: HttpCache.compress(content, encoding))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error generating download: {str(e)}")
+    
+    headers = HttpCache.headers(etag, encoding)
+    headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return Response(content=content, media_type=media_type, headers=headers)
+
+@app.get("/export/{fmt}")
+def export_bilingual(fmt: str, tags: str = 'render', state: Optional[List[str]] = Query(None),
+                     include_untranslated: bool = False, loaded: LoadedDocument = Depends(get_document)):
+    """Stream source/target pairs as TMX, TSV or JSON Lines"""
+    try:
+        # Streamed from copies read chunk by chunk, so a slow client doesn't hold up edits
+        with loaded.lock.read():
+            chunks = BilingualExporter.export(
+                loaded.tree,
+                fmt,
+                tags=tags,
+                states=set(state) if state else None,
+                include_untranslated=include_untranslated,
+                trans_units=loaded.iter_trans_units()
             )
-        
-        # Return as XLIFF with appropriate media type based on extension
-        filename_lower = filename.lower()
-        if filename_lower.endswith('.sdlxliff'):
-            media_type = 'application/x-sdlxliff+xml'
-        else:
-            media_type = 'application/x-xliff+xml'
-        
-        return Response(
-            content=xml_content,
-            media_type=media_type,
-            headers={
-                'Content-Disposition': f'attachment; filename="{filename}"'
-            }
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating download: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    media_type, extension = BilingualExporter.FORMATS[fmt]
+    filename = (loaded.filename or 'export').rsplit('.', 1)[0] + extension
+    
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"'
+        }
+    )
 
 @app.delete("/clear")
-async def clear_current_file():
-    """Clear the currently loaded file"""
-    current_file_store.clear()
+def clear_current_file(document_id: Optional[str] = None):
+    """Remove the currently loaded file (or the given document) from the store"""
+    document_id = document_id or document_store.current_id()
+    if document_id is not None:
+        document_store.delete_document(document_id)
     return {"message": "File cleared"}
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Workers share documents through the store, so any number can be started
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=int(os.environ.get("WEB_CONCURRENCY", 1)))
\ No newline at end of file
@@ -24,6 +24,8 @@ class TransUnit(BaseModel):
     state: Optional[str] = None  # translated, needs-review, etc.
     notes: List[str] = []
     attributes: Dict[str, Any] = {}
+    version: int = 0  # Incremented on every stored edit, used for conflict detection
+    segment_ids: List[str] = []  # mids of <mrk mtype="seg"> sub-segments in <seg-source>
 
 class XliffFile(BaseModel):
     """Represents a file element in XLIFF"""
@@ -37,10 +39,170 @@ class XliffDocument(BaseModel):
     """Represents the entire XLIFF document"""
     version: str
     files: List[XliffFile] = []
+    document_id: Optional[str] = None  # Id in the shared document store
+    document_version: int = 0  # Store version the model reflects
     
 class TransUnitUpdate(BaseModel):
     """For updating a trans-unit's target"""
     file_index: int
     trans_unit_id: str
     target_text: str
-    target_tags: List[XliffTag] = []
\ No newline at end of file
+    target_tags: List[XliffTag] = []
+    expected_version: Optional[int] = None  # Reject the update if the unit changed since this version
+
+class SegmentQuery(BaseModel):
+    """Filters and sort order for querying trans-units through the segment index"""
+    file_index: Optional[int] = None
+    states: Optional[List[Optional[str]]] = None  # null matches units without a state
+    has_notes: Optional[bool] = None
+    has_target: Optional[bool] = None  # target with text besides inline tags
+    translate: Optional[bool] = None  # False matches translate="no"
+    attributes: Dict[str, Optional[str]] = {}  # key -> required value (null: key present)
+    hide_empty_sources: bool = False
+    min_source_length: Optional[int] = None
+    max_source_length: Optional[int] = None
+    min_target_length: Optional[int] = None
+    max_target_length: Optional[int] = None
+    sort_by: str = 'document'  # document, id, state, source_length, target_length
+    descending: bool = False
+    offset: int = 0
+    limit: int = 100
+
+class SegmentRef(BaseModel):
+    """Identifies a trans-unit within the loaded document"""
+    file_index: int
+    trans_unit_id: str
+
+class SegmentQueryResult(BaseModel):
+    """A page of trans-unit ids matching a segment query"""
+    total: int
+    offset: int
+    limit: int
+    ids: List[SegmentRef] = []
+
+class SdlSegment(BaseModel):
+    """A sub-segment (<mrk mtype="seg">) of an SDLXLIFF trans-unit with its confirmation status"""
+    mid: str
+    file_index: int
+    trans_unit_id: str
+    source: Optional[SegmentContent] = None  # Only filled when the trans-unit's segments are requested
+    target: Optional[SegmentContent] = None
+    conf: Optional[str] = None  # Draft, Translated, ApprovedTranslation, ...
+    locked: bool = False
+    origin: Optional[str] = None
+    version: int = 0  # Of the target, expected by PUT /sdl/segment
+    status_version: int = 0  # Of conf/locked, expected by PUT /sdl/segment/status
+
+class SdlSegmentUpdate(BaseModel):
+    """For updating the target of one SDLXLIFF sub-segment"""
+    file_index: int
+    trans_unit_id: str
+    mid: str
+    target_text: str
+    target_tags: List[XliffTag] = []
+    conf: Optional[str] = None  # Optionally set the confirmation level in the same request
+    expected_version: Optional[int] = None
+
+class SdlStatusUpdate(BaseModel):
+    """For updating the confirmation level or lock of one SDLXLIFF sub-segment"""
+    file_index: int
+    mid: str
+    conf: Optional[str] = None
+    locked: Optional[bool] = None
+    expected_version: Optional[int] = None
+
+class MergeConflict(BaseModel):
+    """A trans-unit that was matched during a merge but not updated"""
+    file_index: int
+    trans_unit_id: str
+    reason: str  # 'target-differs', 'source-differs', 'segmentation-differs' or 'segment-locked'
+
+class MergeReport(BaseModel):
+    """Outcome of merging an external bilingual file into the loaded document"""
+    total: int = 0  # Records read from the incoming file
+    matched: int = 0  # Records applied to at least one trans-unit
+    matched_by_source: int = 0  # ... of which were matched by source text instead of id
+    skipped: int = 0  # Records without a match, without a target or with an unchanged target
+    conflicting: int = 0  # Trans-units left unchanged because of a conflict
+    updated_units: int = 0
+    conflicts: List[MergeConflict] = []  # Details of the first conflicts
+    document_version: int = 0
+
+class TextDiffOp(BaseModel):
+    """One run of a token-level text diff"""
+    op: str  # 'equal', 'insert' or 'delete'
+    text: str
+
+class UnitDiff(BaseModel):
+    """A trans-unit that differs between two documents"""
+    file: Optional[str] = None  # original attribute of the <file>
+    trans_unit_id: str
+    change: str  # 'added', 'removed' or 'modified'
+    fields: List[str] = []  # For modified units: source, source_tags, target, target_tags, state, notes, attributes
+    old_state: Optional[str] = None
+    new_state: Optional[str] = None
+    source_diff: List[TextDiffOp] = []
+    target_diff: List[TextDiffOp] = []
+
+class DiffResult(BaseModel):
+    """Paged changes between two documents"""
+    added: int = 0
+    removed: int = 0
+    modified: int = 0
+    unchanged: int = 0
+    total_changes: int = 0
+    offset: int = 0
+    limit: Optional[int] = None
+    changes: List[UnitDiff] = []
+
+class PretranslateRequest(BaseModel):
+    """For pre-translating empty targets of the loaded document"""
+    provider: str = 'pseudo'
+    file_index: Optional[int] = None  # Only this file (default: all files)
+    overwrite: bool = False  # Also replace existing targets
+    state: Optional[str] = 'needs-review-translation'  # State set on pre-translated units
+    max_batch_chars: Optional[int] = None  # Defaults to the provider's limit
+    concurrency: int = 4  # Provider calls in flight at once
+
+class PretranslateReport(BaseModel):
+    """Outcome of a pre-translation run"""
+    provider: str
+    candidates: int = 0  # Trans-units sent for translation
+    translated: int = 0  # Targets written
+    failed: int = 0  # Units in batches that failed after all retries
+    skipped: int = 0  # Units edited by someone else while they were being translated
+    batches: int = 0
+    failed_batches: int = 0
+    document_version: int = 0
+
+class TermHit(BaseModel):
+    """A glossary term found in a source segment"""
+    start: int  # Character offsets in the segment text (tag markers included)
+    end: int
+    text: str  # Matched text as it appears in the segment
+    term: str  # Glossary source term
+    targets: List[str] = []  # Approved target terms
+    entry_index: int
+    found_in_target: Optional[bool] = None  # None when the unit has no target
+
+class SegmentTerms(BaseModel):
+    """Glossary hits of one trans-unit"""
+    file_index: Optional[int] = None
+    trans_unit_id: Optional[str] = None
+    hits: List[TermHit] = []
+    missing: List[str] = []  # Source terms whose approved translation is not in the target
+
+class TermCheckRequest(BaseModel):
+    """For checking arbitrary source/target text against a glossary"""
+    source: str
+    target: Optional[str] = None
+
+class GlossaryInfo(BaseModel):
+    """A stored glossary"""
+    id: str
+    name: str
+    source_language: Optional[str] = None
+    target_language: Optional[str] = None
+    entries: int = 0
+    case_sensitive: bool = False
+    stemming: bool = False
@@ -0,0 +1,294 @@
+"""
+Parallel parsing of large XLIFF files into the document model
+
+A byte-level pre-scan finds the <body> of every <file> and splits it into
+ranges of whole top-level trans-units and groups. Each range is wrapped in
+copies of the root, <file> and <body> start tags, which carry the namespace
+declarations, so it parses as a document of its own in a worker process.
+Workers return plain tuples, which pickle far faster than pydantic models;
+the parent rebuilds the models in document order while later ranges are
+still being parsed. Anything unexpected falls back to the in-process parse.
+"""
+
+import gc
+import multiprocessing
+import os
+import re
+import threading
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional, Tuple
+from lxml import etree
+from models import SegmentContent, TransUnit, XliffDocument, XliffTag
+from xliff_parser import XliffParser
+from xliff_query import XliffQuery
+
+class ScannedBody(NamedTuple):
+    """Byte layout of a <file>'s <body> found by the pre-scan"""
+    file_index: int
+    wrapper_start: bytes  # Root, <file> and <body> start tags
+    wrapper_end: bytes  # Matching end tags
+    ranges: List[Tuple[int, int]]  # Byte ranges of whole top-level body children
+
+class ParallelParser:
+    """Multi-process parse of large documents, merged into the same XliffDocument as XliffParser.parse_tree"""
+
+    # Smaller files are parsed in-process
+    MIN_SIZE = 8 * 1024 * 1024
+
+    # Body ranges per worker (more ranges balance the load better) and their minimum size
+    RANGES_PER_WORKER = 4
+    MIN_RANGE_SIZE = 256 * 1024
+
+    TAG_FIELDS = tuple(XliffTag.model_fields)
+
+    # Comments, PIs, the doctype and element start tags before the root element
+    PROLOG = re.compile(rb'<!--.*?-->|<\?.*?\?>|<!DOCTYPE|<([^\s/>!?]+)(?:"[^"]*"|\'[^\']*\'|[^"\'>])*>', re.S)
+    ENCODING = re.compile(rb'encoding\s*=\s*["\']([\w.-]+)["\']')
+
+    _pool: Optional[ProcessPoolExecutor] = None
+    _pool_size = 0
+    _pool_lock = threading.Lock()
+
+    @staticmethod
+    def workers() -> int:
+        """
+        Worker processes: XLIFF_PARSE_WORKERS (0 or 1 parses in-process), by default the CPUs
+        divided between the server worker processes (WEB_CONCURRENCY), as each has its own pool
+        """
+        server_workers = max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+        default = max((os.cpu_count() or 1) // server_workers, 1)
+        return int(os.environ.get('XLIFF_PARSE_WORKERS', default))
+
+    @staticmethod
+    @contextmanager
+    def paused_gc():
+        """
+        Suspend cyclic garbage collection while building many long-lived objects
+        (collections triggered by the allocations would find nothing to free).
+        Only for worker processes: the switch is process-wide, so in the server it
+        would also pause collection for every other request.
+        """
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            yield
+        finally:
+            if enabled:
+                gc.enable()
+
+    @classmethod
+    def _executor(cls, workers: int) -> ProcessPoolExecutor:
+        """Process pool shared by all parses (spawned, as the server process runs threads)"""
+        with cls._pool_lock:
+            if cls._pool is None or cls._pool_size != workers:
+                if cls._pool is not None:
+                    cls._pool.shutdown(wait=False)
+                cls._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+                cls._pool_size = workers
+            return cls._pool
+
+    @classmethod
+    def _discard_executor(cls, pool: ProcessPoolExecutor):
+        with cls._pool_lock:
+            if cls._pool is pool:
+                cls._pool = None
+        pool.shutdown(wait=False)
+
+    @staticmethod
+    def _structure(prefix: bytes) -> re.Pattern:
+        """Start and end tags of <file>, <body> and <group> with the root's prefix, skipping comments and CDATA"""
+        return re.compile(
+            rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<(/?)' + re.escape(prefix)
+            + rb'(file|body|group)(?=[\s/>])(?:"[^"]*"|\'[^\']*\'|[^"\'>])*>',
+            re.S
+        )
+
+    @staticmethod
+    def _split(content: bytes, start: int, end: int, groups: List[Tuple[int, int]],
+               unit_end: bytes, range_size: int) -> List[Tuple[int, int]]:
+        """Split body content into ranges ending between top-level children"""
+        group_ends = [group_end for _, group_end in groups]
+        ranges = []
+        position = start
+        while end - position > range_size:
+            target = position + range_size
+
+            # Next top-level group ending after the target, and the next trans-unit end
+            index = bisect_right(group_ends, target)
+            group = groups[index] if index < len(groups) else None
+            found = content.find(unit_end, target, end)
+
+            if group is not None and group[0] < target:
+                boundary = group[1]  # The target is inside a group: split after it
+            elif group is not None and (found < 0 or group[0] < found):
+                boundary = group[0]  # A group starts before the next trans-unit ends
+            elif found >= 0:
+                boundary = found + len(unit_end)
+            else:
+                break
+            if boundary >= end:
+                break
+            ranges.append((position, boundary))
+            position = boundary
+        ranges.append((position, end))
+        return ranges
+
+    @staticmethod
+    def scan(content: bytes, range_size: int) -> Optional[Tuple[int, List[ScannedBody]]]:
+        """
+        Pre-scan the raw bytes for <file>/<body> boundaries and top-level groups
+        Returns the number of files and their bodies, or None if the file can't be split
+        (not UTF-8, a doctype that may declare entities, or an unexpected layout)
+        """
+        offset = 3 if content.startswith(b'\xef\xbb\xbf') else 0
+        declaration = re.match(rb'\s*<\?xml[^>]*\?>', content[offset:offset + 1024])
+        if declaration is not None:
+            encoding = ParallelParser.ENCODING.search(declaration.group(0))
+            if encoding is not None and encoding.group(1).lower() not in (b'utf-8', b'utf8'):
+                return None
+
+        root = None
+        for match in ParallelParser.PROLOG.finditer(content, offset):
+            if match.group(0) == b'<!DOCTYPE':
+                return None
+            if match.group(1) is not None:
+                root = match
+                break
+        if root is None or root.group(0).endswith(b'/>'):
+            return None
+        root_name = root.group(1)
+        prefix = root_name[:root_name.index(b':') + 1] if b':' in root_name else b''
+        unit_end = b'</' + prefix + b'trans-unit>'
+        wrapper_end = b'</' + prefix + b'body></' + prefix + b'file></' + root_name + b'>'
+
+        bodies = []
+        file_count = 0
+        file_tag = body_tag = None
+        body_start = None
+        depth = 0
+        group_start = 0
+        groups: List[Tuple[int, int]] = []
+        for match in ParallelParser._structure(prefix).finditer(content, root.end()):
+            name = match.group(2)
+            if name is None:
+                continue
+            closing = match.group(1) == b'/'
+            empty = not closing and match.group(0).endswith(b'/>')
+
+            if name == b'file':
+                if not closing:
+                    file_count += 1
+                    file_tag = None if empty else match.group(0)
+            elif name == b'body':
+                if closing and body_start is not None:
+                    if depth != 0 or file_tag is None:
+                        return None
+                    ranges = ParallelParser._split(content, body_start, match.start(), groups, unit_end, range_size)
+                    bodies.append(ScannedBody(file_count - 1, root.group(0) + file_tag + body_tag, wrapper_end, ranges))
+                    body_start = None
+                elif not closing and not empty:
+                    body_tag = match.group(0)
+                    body_start = match.end()
+                    groups = []
+            elif name == b'group' and body_start is not None:
+                if closing:
+                    depth -= 1
+                    if depth == 0:
+                        groups.append((group_start, match.end()))
+                elif empty:
+                    if depth == 0:
+                        groups.append((match.start(), match.end()))
+                else:
+                    if depth == 0:
+                        group_start = match.start()
+                    depth += 1
+        return file_count, bodies
+
+    @staticmethod
+    def dump_trans_unit(trans_unit: TransUnit) -> tuple:
+        """Compact picklable form of a trans-unit"""
+        def segment(content: Optional[SegmentContent]):
+            if content is None:
+                return None
+            return content.text, [tuple(getattr(tag, field) for field in ParallelParser.TAG_FIELDS)
+                                  for tag in content.tags]
+
+        return (trans_unit.id, segment(trans_unit.source), segment(trans_unit.target), trans_unit.state,
+                trans_unit.notes, trans_unit.attributes, trans_unit.segment_ids)
+
+    @staticmethod
+    def load_trans_unit(row: tuple) -> TransUnit:
+        """Rebuild a trans-unit from dump_trans_unit()"""
+        def segment(data) -> Optional[SegmentContent]:
+            if data is None:
+                return None
+            text, tags = data
+            return SegmentContent(text=text, tags=[XliffTag(**dict(zip(ParallelParser.TAG_FIELDS, tag)))
+                                                   for tag in tags])
+
+        trans_unit_id, source, target, state, notes, attributes, segment_ids = row
+        return TransUnit(id=trans_unit_id, source=segment(source), target=segment(target), state=state,
+                         notes=notes, attributes=attributes, segment_ids=segment_ids)
+
+    @staticmethod
+    def parse_range(data: bytes) -> List[tuple]:
+        """Parse a wrapped body range into trans-unit rows (runs in a worker process)"""
+        with ParallelParser.paused_gc():
+            root = etree.fromstring(data)
+            query = XliffQuery.for_element(root)
+            return [ParallelParser.dump_trans_unit(XliffParser.parse_trans_unit(tu_elem, query))
+                    for tu_elem in query.trans_units(root)]
+
+    @staticmethod
+    def _parse_parallel(content: bytes, tree: etree.Element, workers: int) -> Optional[XliffDocument]:
+        query = XliffQuery.for_element(tree)
+        file_elements = query.files(tree)
+        range_size = max(ParallelParser.MIN_RANGE_SIZE, len(content) // (workers * ParallelParser.RANGES_PER_WORKER))
+        scanned = ParallelParser.scan(content, range_size)
+        if scanned is None or scanned[0] != len(file_elements):
+            return None
+
+        tasks = []
+        for body in scanned[1]:
+            for start, end in body.ranges:
+                tasks.append((body.file_index, body.wrapper_start + content[start:end] + body.wrapper_end))
+
+        pool = ParallelParser._executor(workers)
+        trans_units: List[List[TransUnit]] = [[] for _ in file_elements]
+        try:
+            # Results come back in order, so models are built while later ranges are parsed
+            results = pool.map(ParallelParser.parse_range, [data for _, data in tasks])
+            for (file_index, _), rows in zip(tasks, results):
+                trans_units[file_index].extend(ParallelParser.load_trans_unit(row) for row in rows)
+        except BrokenProcessPool:
+            ParallelParser._discard_executor(pool)
+            return None
+        except Exception:
+            # A range did not parse on its own: the in-process parse reports the error, if any
+            return None
+
+        # The scan must have seen every trans-unit of the tree
+        for file_elem, units in zip(file_elements, trans_units):
+            if len(units) != sum(1 for _ in query.file_trans_units(file_elem)):
+                return None
+
+        files = [XliffParser.parse_file_element(file_elem, units)
+                 for file_elem, units in zip(file_elements, trans_units)]
+        return XliffDocument(version=tree.get('version', '1.2'), files=files)
+
+    @staticmethod
+    def parse(content: bytes, tree: etree.Element) -> XliffDocument:
+        """
+        Document model of a loaded tree (content is the raw file it was parsed from)
+        Large files are parsed in worker processes, others in-process
+        """
+        workers = ParallelParser.workers()
+        if workers > 1 and len(content) >= ParallelParser.MIN_SIZE:
+            document = ParallelParser._parse_parallel(content, tree, workers)
+            if document is not None:
+                return document
+
+        return XliffParser.parse_tree(tree)
@@ -0,0 +1,256 @@
+"""
+Pre-translation of empty targets through pluggable MT providers
+
+Untranslated trans-units are collected from a loaded document, their inline
+tags are swapped for numbered placeholders, and the texts are sent to the
+provider in batches limited by character count. Batches run concurrently up
+to a limit and are retried with exponential backoff. Translations come back
+as SegmentContent with the original XliffTag objects at their new positions,
+ready to be written in one bulk edit.
+"""
+
+import asyncio
+import re
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+from models import PretranslateReport, SdlSegment, SegmentContent, TransUnit, XliffDocument, XliffTag
+from xliff_parser import XliffParser
+
+class ProviderError(Exception):
+    """A provider call failed (retried by the pre-translator)"""
+
+class TranslationProvider(ABC):
+    """Interface of a machine translation engine"""
+
+    name = ''
+
+    # Largest batch (in characters of source text) the engine accepts
+    max_batch_chars = 5000
+
+    @abstractmethod
+    async def translate(self, texts: List[str], source_language: str,
+                        target_language: Optional[str]) -> List[str]:
+        """
+        Translate a batch of texts, returning one translation per text in the same order
+        Placeholders (⟦1⟧, ⟦2⟧, ...) must be kept in the output
+        """
+        pass
+
+class PseudoTranslationProvider(TranslationProvider):
+    """
+    Deterministic local pseudo-translation: accented letters, ~30% expansion and
+    brackets, so layout and tag handling can be checked (and benchmarked) offline
+    """
+
+    name = 'pseudo'
+
+    ACCENTS = str.maketrans(
+        'AaCcEeIiNnOoUuYy',
+        'ÀàÇçÉéÎîÑñÖöÛûÝý'
+    )
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency  # Simulated round-trip time per call, in seconds
+
+    def pseudo_translate(self, text: str) -> str:
+        parts = PreTranslator.PLACEHOLDER.split(text)
+        # Odd parts are placeholder numbers captured by the split
+        out = []
+        for i, part in enumerate(parts):
+            if i % 2:
+                out.append(f'⟦{part}⟧')
+            else:
+                out.append(part.translate(self.ACCENTS))
+        letters = sum(1 for c in text if c.isalpha())
+        padding = '~' * ((letters * 3 + 9) // 10)
+        return f'[{"".join(out)}{padding}]'
+
+    async def translate(self, texts: List[str], source_language: str,
+                        target_language: Optional[str]) -> List[str]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self.pseudo_translate(text) for text in texts]
+
+# Providers selectable by name in the API
+PROVIDERS: Dict[str, Type[TranslationProvider]] = {
+    PseudoTranslationProvider.name: PseudoTranslationProvider,
+}
+
+def get_provider(name: str) -> TranslationProvider:
+    """Create a provider by name"""
+    provider_class = PROVIDERS.get(name)
+    if provider_class is None:
+        raise ValueError(f"Unknown provider '{name}', expected one of {', '.join(PROVIDERS)}")
+    return provider_class()
+
+class PretranslateItem(NamedTuple):
+    """A trans-unit waiting for pre-translation"""
+    file_index: int
+    trans_unit_id: str
+    text: str  # Source text with placeholders
+    tags: List[XliffTag]  # Tags in placeholder order
+    version: int  # Target version when the unit was collected
+    mid: Optional[str] = None  # SDLXLIFF sub-segment, translated on its own
+
+class PreTranslator:
+    """Batched, concurrency-limited pre-translation pipeline"""
+
+    PLACEHOLDER = re.compile(r'⟦(\d+)⟧')
+
+    def __init__(self, provider: TranslationProvider, max_batch_chars: Optional[int] = None,
+                 max_batch_size: int = 100, concurrency: int = 4,
+                 retries: int = 3, backoff: float = 0.5):
+        self.provider = provider
+        self.max_batch_chars = min(max_batch_chars or provider.max_batch_chars, provider.max_batch_chars)
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+
+    @staticmethod
+    def to_placeholders(segment: SegmentContent) -> Tuple[str, List[XliffTag]]:
+        """Replace tag markers with numbered placeholders (⟦1⟧, ⟦2⟧, ...)"""
+        tags = sorted(segment.tags, key=lambda tag: tag.position)
+        parts = []
+        last = 0
+        for number, tag in enumerate(tags, 1):
+            parts.append(segment.text[last:tag.position])
+            parts.append(f'⟦{number}⟧')
+            last = tag.position + len(f'⟨{tag.tag_type}⟩')
+        parts.append(segment.text[last:])
+        return ''.join(parts), tags
+
+    @staticmethod
+    def from_placeholders(text: str, tags: List[XliffTag]) -> SegmentContent:
+        """
+        Turn placeholders back into tag markers with updated positions
+        Unknown or repeated placeholders are dropped, missing tags are appended at the end
+        """
+        parts = []
+        restored = []
+        used = set()
+        position = 0
+        last = 0
+
+        def add_tag(tag: XliffTag):
+            nonlocal position
+            marker = f'⟨{tag.tag_type}⟩'
+            restored.append(tag.model_copy(update={'position': position}))
+            parts.append(marker)
+            position += len(marker)
+
+        for match in PreTranslator.PLACEHOLDER.finditer(text):
+            between = text[last:match.start()]
+            parts.append(between)
+            position += len(between)
+            last = match.end()
+
+            number = int(match.group(1))
+            if 1 <= number <= len(tags) and number not in used:
+                used.add(number)
+                add_tag(tags[number - 1])
+
+        tail = text[last:]
+        parts.append(tail)
+        position += len(tail)
+
+        for number, tag in enumerate(tags, 1):
+            if number not in used:
+                add_tag(tag)
+
+        return SegmentContent(text=''.join(parts), tags=restored)
+
+    @staticmethod
+    def is_empty(segment: Optional[SegmentContent]) -> bool:
+        """True for a missing target or one holding nothing but inline tags"""
+        return segment is None or not XliffParser.TAG_MARKER.sub('', segment.text).strip()
+
+    @staticmethod
+    def collect(document: XliffDocument, file_index: Optional[int] = None, overwrite: bool = False,
+                segments: Optional[Callable[[int, TransUnit], List[SdlSegment]]] = None) -> List[PretranslateItem]:
+        """
+        Trans-units with an empty target (or all translatable units with overwrite)
+        With segments, units with SDLXLIFF sub-segments are collected segment by segment
+        (unlocked ones only), so their targets keep the segmentation
+        """
+        items = []
+        for fi, xliff_file in enumerate(document.files):
+            if file_index is not None and fi != file_index:
+                continue
+            for tu in xliff_file.trans_units:
+                if tu.attributes.get('translate') == 'no' or not tu.source.text.strip():
+                    continue
+                if segments is not None and tu.segment_ids:
+                    for segment in segments(fi, tu):
+                        if segment.locked or segment.source is None or not segment.source.text.strip():
+                            continue
+                        if not overwrite and not PreTranslator.is_empty(segment.target):
+                            continue
+                        text, tags = PreTranslator.to_placeholders(segment.source)
+                        items.append(PretranslateItem(fi, tu.id, text, tags, segment.version, segment.mid))
+                    continue
+                if not overwrite and not PreTranslator.is_empty(tu.target):
+                    continue
+                text, tags = PreTranslator.to_placeholders(tu.source)
+                items.append(PretranslateItem(fi, tu.id, text, tags, tu.version))
+        return items
+
+    def batches(self, items: List[PretranslateItem]) -> List[List[PretranslateItem]]:
+        """Split items into batches by character budget (one file per batch)"""
+        batches = []
+        batch: List[PretranslateItem] = []
+        size = 0
+        for item in items:
+            full = len(batch) >= self.max_batch_size or size + len(item.text) > self.max_batch_chars
+            if batch and (full or item.file_index != batch[0].file_index):
+                batches.append(batch)
+                batch = []
+                size = 0
+            batch.append(item)
+            size += len(item.text)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _translate_batch(self, batch: List[PretranslateItem], languages: Tuple[str, Optional[str]],
+                               semaphore: asyncio.Semaphore) -> Optional[List[str]]:
+        """Run one provider call with retries; None if every attempt failed"""
+        texts = [item.text for item in batch]
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    translations = await self.provider.translate(texts, *languages)
+                    if len(translations) != len(texts):
+                        raise ProviderError(f'Expected {len(texts)} translations, got {len(translations)}')
+                    return translations
+                except Exception:
+                    if attempt == self.retries:
+                        return None
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def run(self, document: XliffDocument, items: List[PretranslateItem],
+                  report: PretranslateReport) -> Dict[Tuple[int, str, Optional[str]], SegmentContent]:
+        """Translate the items; returns the new targets by (file index, trans-unit id, mid)"""
+        batches = self.batches(items)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(
+            self._translate_batch(
+                batch,
+                (document.files[batch[0].file_index].source_language,
+                 document.files[batch[0].file_index].target_language),
+                semaphore
+            )
+            for batch in batches
+        ))
+
+        report.candidates += len(items)
+        report.batches += len(batches)
+        targets = {}
+        for batch, translations in zip(batches, results):
+            if translations is None:
+                report.failed_batches += 1
+                report.failed += len(batch)
+                continue
+            for item, translation in zip(batch, translations):
+                targets[(item.file_index, item.trans_unit_id, item.mid)] = PreTranslator.from_placeholders(translation, item.tags)
+        return targets
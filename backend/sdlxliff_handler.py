@@ -0,0 +1,191 @@
+"""
+Handler for SDLXLIFF (SDL Trados Studio) sub-segments
+
+Trados keeps its real segmentation outside <source>/<target>:
+- <seg-source> holds the source split into <mrk mtype="seg" mid="..."> segments
+- <target> holds the translated segments as <mrk> elements with the same mids
+- <sdl:seg-defs> holds one <sdl:seg id="mid"> per segment with its confirmation
+  level (conf), lock flag and origin
+"""
+
+import copy
+from typing import Dict, List, Optional, Set, Tuple
+from lxml import etree
+from models import SdlSegment, SegmentContent, XliffTag
+from xliff_parser import XliffParser
+from xliff_query import XliffQuery
+
+SDL_NS = 'http://sdl.com/FileTypes/SdlXliff/1.0'
+
+class SdlSegmentIndex:
+    """Index of <sdl:seg> elements by (file index, mid) for O(1) status and lock updates"""
+
+    def __init__(self, tree: etree.Element):
+        self.seg_defs: Dict[Tuple[int, str], etree.Element] = {}
+        self.trans_units: Dict[Tuple[int, str], etree.Element] = {}
+        self.order: List[Tuple[int, str]] = []
+        self.by_conf: Dict[Optional[str], Set[Tuple[int, str]]] = {}
+        self.locked: Set[Tuple[int, str]] = set()
+
+        query = XliffQuery.for_element(tree)
+        seg_tag = f'{{{SDL_NS}}}seg'
+        for file_index, file_elem in enumerate(query.files(tree)):
+            for seg in file_elem.iter(seg_tag):
+                mid = seg.get('id')
+                seg_defs = seg.getparent()
+                if mid is None or seg_defs is None or seg_defs.getparent() is None:
+                    continue
+                key = (file_index, mid)
+                self.seg_defs[key] = seg
+                self.trans_units[key] = seg_defs.getparent()
+                self.order.append(key)
+                self._add_status(key, seg)
+
+    def _add_status(self, key: Tuple[int, str], seg: etree.Element):
+        self.by_conf.setdefault(seg.get('conf'), set()).add(key)
+        if seg.get('locked') == 'true':
+            self.locked.add(key)
+
+    def _remove_status(self, key: Tuple[int, str], seg: etree.Element):
+        self.by_conf.get(seg.get('conf'), set()).discard(key)
+        self.locked.discard(key)
+
+    def set_status(self, file_index: int, mid: str, conf: Optional[str], locked: bool) -> bool:
+        """Update a segment's confirmation level and lock; False if the segment is unknown"""
+        key = (file_index, mid)
+        seg = self.seg_defs.get(key)
+        if seg is None:
+            return False
+
+        self._remove_status(key, seg)
+        if conf is None:
+            seg.attrib.pop('conf', None)
+        else:
+            seg.set('conf', conf)
+        if locked:
+            seg.set('locked', 'true')
+        else:
+            seg.attrib.pop('locked', None)
+        self._add_status(key, seg)
+        return True
+
+    def status(self, file_index: int, mid: str) -> Optional[Dict]:
+        """Current confirmation level, lock and origin of a segment"""
+        seg = self.seg_defs.get((file_index, mid))
+        if seg is None:
+            return None
+        return {
+            'conf': seg.get('conf'),
+            'locked': seg.get('locked') == 'true',
+            'origin': seg.get('origin'),
+        }
+
+    def select(self, conf: Optional[str] = None, locked: Optional[bool] = None) -> List[Tuple[int, str]]:
+        """Segments in document order, optionally filtered by confirmation level and lock"""
+        keys = self.order
+        if conf is not None:
+            matching = self.by_conf.get(conf, set())
+            keys = [key for key in keys if key in matching]
+        if locked is not None:
+            keys = [key for key in keys if (key in self.locked) == locked]
+        return keys
+
+class SdlXliffHandler:
+    """Handler for SDLXLIFF sub-segments (<mrk mtype="seg">)"""
+
+    @staticmethod
+    def child(tu_elem: etree.Element, name: str) -> Optional[etree.Element]:
+        """Find a direct XLIFF child of a trans-unit in its own namespace"""
+        return XliffQuery.for_element(tu_elem).child(tu_elem, name)
+
+    @staticmethod
+    def _segment_markers(element: Optional[etree.Element]) -> Dict[str, etree.Element]:
+        """Map mid -> <mrk mtype="seg"> element (at any depth, e.g. inside <g>)"""
+        if element is None:
+            return {}
+        mrk_tag = XliffQuery.for_element(element).mrk_tag
+        return {mrk.get('mid'): mrk for mrk in element.iter(mrk_tag)
+                if mrk.get('mtype') == 'seg' and mrk.get('mid') is not None}
+
+    @staticmethod
+    def segment_contents(element: Optional[etree.Element]) -> Dict[str, SegmentContent]:
+        """Parsed content of each sub-segment of a target (or any segment element) by mid"""
+        return {mid: XliffParser.parse_segment(mrk)
+                for mid, mrk in SdlXliffHandler._segment_markers(element).items()}
+
+    @staticmethod
+    def parse_segments(tu_elem: etree.Element, file_index: int,
+                       index: SdlSegmentIndex) -> List[SdlSegment]:
+        """Parse the sub-segments of one trans-unit (source, target and status)"""
+        source_markers = SdlXliffHandler._segment_markers(SdlXliffHandler.child(tu_elem, 'seg-source'))
+        target_markers = SdlXliffHandler._segment_markers(SdlXliffHandler.child(tu_elem, 'target'))
+
+        segments = []
+        for mid, source_mrk in source_markers.items():
+            target_mrk = target_markers.get(mid)
+            status = index.status(file_index, mid) or {}
+            segments.append(SdlSegment(
+                mid=mid,
+                file_index=file_index,
+                trans_unit_id=tu_elem.get('id'),
+                source=XliffParser.parse_segment(source_mrk),
+                target=XliffParser.parse_segment(target_mrk) if target_mrk is not None else None,
+                conf=status.get('conf'),
+                locked=status.get('locked', False),
+                origin=status.get('origin')
+            ))
+        return segments
+
+    @staticmethod
+    def _ensure_target_marker(tu_elem: etree.Element, mid: str) -> Optional[etree.Element]:
+        """
+        Find the target <mrk> for a mid, creating the target from <seg-source> if needed
+        (existing target segments are kept, new ones start empty)
+        """
+        target_elem = SdlXliffHandler.child(tu_elem, 'target')
+        target_markers = SdlXliffHandler._segment_markers(target_elem)
+        if mid in target_markers:
+            return target_markers[mid]
+
+        seg_source_elem = SdlXliffHandler.child(tu_elem, 'seg-source')
+        if mid not in SdlXliffHandler._segment_markers(seg_source_elem):
+            return None
+
+        # Rebuild the target with the segmentation of <seg-source>
+        new_target = copy.deepcopy(seg_source_elem)
+        new_target.tag = XliffQuery.for_element(tu_elem).target_tag
+        for new_mid, mrk in SdlXliffHandler._segment_markers(new_target).items():
+            existing = target_markers.get(new_mid)
+            for child in list(mrk):
+                mrk.remove(child)
+            mrk.text = None
+            if existing is not None:
+                mrk.text = existing.text
+                for child in existing:
+                    mrk.append(copy.deepcopy(child))
+
+        if target_elem is not None:
+            for attr, value in target_elem.attrib.items():
+                new_target.set(attr, value)
+            new_target.tail = target_elem.tail
+            tu_elem.replace(target_elem, new_target)
+        else:
+            # Place the target right after <seg-source>
+            new_target.tail = seg_source_elem.tail
+            seg_source_elem.addnext(new_target)
+
+        return SdlXliffHandler._segment_markers(new_target).get(mid)
+
+    @staticmethod
+    def update_segment_target(tu_elem: etree.Element, mid: str,
+                              target_text: str, target_tags: List[XliffTag]) -> bool:
+        """Replace the content of one target sub-segment; False if the mid is unknown"""
+        mrk = SdlXliffHandler._ensure_target_marker(tu_elem, mid)
+        if mrk is None:
+            return False
+
+        # reconstruct_segment resets the tail, which here is the text between segments
+        tail = mrk.tail
+        XliffParser.reconstruct_segment(target_text, target_tags, mrk)
+        mrk.tail = tail
+        return True
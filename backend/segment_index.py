@@ -0,0 +1,327 @@
+"""
+Secondary indexes over the trans-units of a parsed document
+
+Rows are numbered in document order. Each index maps a value to the set of
+rows having it, so multi-criteria queries become set intersections starting
+from the most selective filter instead of scans over every trans-unit.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+from models import XliffDocument, TransUnit, SegmentQuery, SegmentQueryResult, SegmentRef
+from xliff_parser import XliffParser
+
+class SegmentIndex:
+    """Per-document secondary indexes built at parse time and maintained on edit"""
+
+    SORT_KEYS = ('document', 'id', 'state', 'source_length', 'target_length')
+
+    # A candidate set smaller than 1/SPARSE_RATIO of all rows is sorted directly,
+    # larger ones are paged by walking the presorted order
+    SPARSE_RATIO = 16
+
+    # Batches of at least this many edits re-sort the length lists once instead of
+    # moving each entry
+    BULK_UPDATE_SIZE = 512
+
+    def __init__(self, document: XliffDocument):
+        self.rows: List[Tuple[int, int]] = []  # row -> (file_index, position in file)
+        self.ids: List[str] = []
+        self.row_by_key: Dict[Tuple[int, str], int] = {}
+        self.states: List[Optional[str]] = []
+        self.source_lengths: List[int] = []
+        self.target_lengths: List[int] = []
+        self.attributes: List[Dict[str, str]] = []
+
+        self.by_file: List[Set[int]] = []
+        self.by_state: Dict[Optional[str], Set[int]] = {}
+        self.by_attribute: Dict[str, Set[int]] = {}
+        self.by_attribute_value: Dict[Tuple[str, str], Set[int]] = {}
+        self.with_notes: Set[int] = set()
+        self.with_target: Set[int] = set()
+        self.empty_sources: Set[int] = set()
+
+        # (length, row) pairs kept sorted for range filters and length ordering
+        self.source_sorted: List[Tuple[int, int]] = []
+        self.target_sorted: List[Tuple[int, int]] = []
+
+        # Lazily built sort orders, dropped when an edit invalidates them
+        self._orders: Dict[str, List[int]] = {}
+
+        for file_index, xliff_file in enumerate(document.files):
+            self.by_file.append(set())
+            for position, trans_unit in enumerate(xliff_file.trans_units):
+                row = len(self.rows)
+                self.rows.append((file_index, position))
+                self.ids.append(trans_unit.id)
+                self.row_by_key.setdefault((file_index, trans_unit.id), row)
+                self.by_file[file_index].add(row)
+                self.states.append(None)
+                self.source_lengths.append(0)
+                self.target_lengths.append(0)
+                self.attributes.append({})
+                self._add(row, trans_unit)
+
+        self.source_sorted.sort()
+        self.target_sorted.sort()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _add(self, row: int, trans_unit: TransUnit, keep_sorted: bool = False):
+        """Add a trans-unit's values to every index"""
+        state = trans_unit.state
+        source_text = trans_unit.source.text if trans_unit.source else ''
+        target_text = trans_unit.target.text if trans_unit.target else ''
+        attributes = {k: str(v) for k, v in trans_unit.attributes.items()}
+
+        self.states[row] = state
+        self.source_lengths[row] = len(source_text)
+        self.target_lengths[row] = len(target_text)
+        self.attributes[row] = attributes
+
+        self.by_state.setdefault(state, set()).add(row)
+        for key, value in attributes.items():
+            self.by_attribute.setdefault(key, set()).add(row)
+            self.by_attribute_value.setdefault((key, value), set()).add(row)
+        if trans_unit.notes:
+            self.with_notes.add(row)
+        # Inline tag markers alone don't make a target translated
+        if XliffParser.TAG_MARKER.sub('', target_text).strip():
+            self.with_target.add(row)
+        if not source_text.strip():
+            self.empty_sources.add(row)
+
+        if keep_sorted:
+            insort(self.source_sorted, (len(source_text), row))
+            insort(self.target_sorted, (len(target_text), row))
+        else:
+            self.source_sorted.append((len(source_text), row))
+            self.target_sorted.append((len(target_text), row))
+
+    def _remove(self, row: int, keep_sorted: bool = True):
+        """Remove a row's current values from every index"""
+        self.by_state[self.states[row]].discard(row)
+        for key, value in self.attributes[row].items():
+            self.by_attribute[key].discard(row)
+            self.by_attribute_value[(key, value)].discard(row)
+        self.with_notes.discard(row)
+        self.with_target.discard(row)
+        self.empty_sources.discard(row)
+
+        if not keep_sorted:
+            return
+
+        for pairs, length in ((self.source_sorted, self.source_lengths[row]),
+                              (self.target_sorted, self.target_lengths[row])):
+            i = bisect_left(pairs, (length, row))
+            if i < len(pairs) and pairs[i] == (length, row):
+                del pairs[i]
+
+    def locate(self, file_index: int, trans_unit_id: str) -> Optional[int]:
+        """Return the position of a trans-unit within its file, or None"""
+        row = self.row_by_key.get((file_index, trans_unit_id))
+        if row is None:
+            return None
+        return self.rows[row][1]
+
+    def update_unit(self, file_index: int, trans_unit: TransUnit):
+        """Re-index a trans-unit after it was edited"""
+        row = self.row_by_key.get((file_index, trans_unit.id))
+        if row is None:
+            return
+
+        old_state = self.states[row]
+        old_target_length = self.target_lengths[row]
+
+        self._remove(row)
+        self._add(row, trans_unit, keep_sorted=True)
+
+        if self.states[row] != old_state:
+            self._orders.pop('state', None)
+        if self.target_lengths[row] != old_target_length:
+            self._orders.pop('target_length', None)
+
+    def update_units(self, units: List[Tuple[int, TransUnit]]):
+        """Re-index a batch of edited trans-units given as (file_index, trans_unit) pairs"""
+        if len(units) < self.BULK_UPDATE_SIZE:
+            for file_index, trans_unit in units:
+                self.update_unit(file_index, trans_unit)
+            return
+
+        for file_index, trans_unit in units:
+            row = self.row_by_key.get((file_index, trans_unit.id))
+            if row is None:
+                continue
+            # The (length, row) lists are rebuilt below
+            self._remove(row, keep_sorted=False)
+            self._add(row, trans_unit, keep_sorted=False)
+
+        rows = range(len(self.rows))
+        self.source_sorted = sorted(zip(self.source_lengths, rows))
+        self.target_sorted = sorted(zip(self.target_lengths, rows))
+        self._orders.clear()
+
+    def _sort_key(self, sort_by: str) -> Optional[Callable[[int], object]]:
+        """Key function for a stable sort of rows already in document order"""
+        if sort_by == 'id':
+            ids = self.ids
+            return lambda row: (0, int(ids[row]), '') if ids[row].isdigit() else (1, 0, ids[row])
+        if sort_by == 'state':
+            states = self.states
+            return lambda row: (states[row] is None, states[row] or '')
+        if sort_by == 'source_length':
+            return self.source_lengths.__getitem__
+        if sort_by == 'target_length':
+            return self.target_lengths.__getitem__
+        return None
+
+    def _order(self, sort_by: str) -> Sequence[int]:
+        """All rows in the given sort order"""
+        if sort_by == 'document':
+            return range(len(self.rows))
+
+        order = self._orders.get(sort_by)
+        if order is None:
+            if sort_by == 'source_length':
+                order = [row for _, row in self.source_sorted]
+            elif sort_by == 'target_length':
+                order = [row for _, row in self.target_sorted]
+            else:
+                order = sorted(range(len(self.rows)), key=self._sort_key(sort_by))
+            self._orders[sort_by] = order
+        return order
+
+    @staticmethod
+    def _length_range(pairs: List[Tuple[int, int]], low: Optional[int], high: Optional[int]) -> Tuple[int, int]:
+        """Slice bounds of the (length, row) pairs within [low, high]"""
+        start = 0 if low is None else bisect_left(pairs, (low, -1))
+        end = len(pairs) if high is None else bisect_right(pairs, (high, float('inf')))
+        return start, max(start, end)
+
+    def query(self, query: SegmentQuery) -> SegmentQueryResult:
+        """Run a multi-criteria query and return one page of matching ids"""
+        if query.sort_by not in self.SORT_KEYS:
+            raise ValueError(f"Unknown sort key '{query.sort_by}', expected one of {', '.join(self.SORT_KEYS)}")
+
+        total_rows = len(self.rows)
+
+        # Filters that select rows: (estimated size, rows)
+        included: List[Tuple[int, Set[int]]] = []
+        # Filters that exclude rows
+        excluded: List[Set[int]] = []
+        # Length ranges applied as predicates: (size, lengths, pairs, start, end)
+        ranges = []
+
+        if query.file_index is not None:
+            rows = self.by_file[query.file_index] if 0 <= query.file_index < len(self.by_file) else set()
+            included.append((len(rows), rows))
+
+        if query.states is not None:
+            if len(query.states) == 1:
+                rows = self.by_state.get(query.states[0], set())
+            else:
+                rows = set().union(*(self.by_state.get(state, set()) for state in query.states))
+            included.append((len(rows), rows))
+
+        for flag, rows in ((query.has_notes, self.with_notes), (query.has_target, self.with_target)):
+            if flag is True:
+                included.append((len(rows), rows))
+            elif flag is False:
+                excluded.append(rows)
+
+        untranslatable = self.by_attribute_value.get(('translate', 'no'), set())
+        if query.translate is False:
+            included.append((len(untranslatable), untranslatable))
+        elif query.translate is True:
+            excluded.append(untranslatable)
+
+        for key, value in query.attributes.items():
+            if value is None:
+                rows = self.by_attribute.get(key, set())
+            else:
+                rows = self.by_attribute_value.get((key, value), set())
+            included.append((len(rows), rows))
+
+        if query.hide_empty_sources:
+            excluded.append(self.empty_sources)
+
+        for low, high, lengths, pairs in (
+            (query.min_source_length, query.max_source_length, self.source_lengths, self.source_sorted),
+            (query.min_target_length, query.max_target_length, self.target_lengths, self.target_sorted),
+        ):
+            if low is None and high is None:
+                continue
+            start, end = self._length_range(pairs, low, high)
+            ranges.append((end - start, lengths, pairs, start, end, low, high))
+
+        # Start from the most selective filter and narrow it down with the rest.
+        # Index sets are never mutated here, every step builds a new set.
+        candidates: Optional[Set[int]] = None
+        included.sort(key=lambda item: item[0])
+        ranges.sort(key=lambda item: item[0])
+
+        if ranges and (not included or ranges[0][0] < included[0][0]):
+            _, _, pairs, start, end, _, _ = ranges.pop(0)
+            candidates = {row for _, row in pairs[start:end]}
+
+        for _, rows in included:
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                break
+
+        skipped: Set[int] = set()
+
+        if candidates is not None:
+            for rows in excluded:
+                candidates = candidates - rows
+            for _, lengths, _, _, _, low, high in ranges:
+                candidates = {row for row in candidates
+                              if (low is None or lengths[row] >= low) and (high is None or lengths[row] <= high)}
+        elif excluded:
+            skipped = set().union(*excluded)
+
+        # Order and page the result
+        offset = max(query.offset, 0)
+        limit = max(query.limit, 0)
+        wanted = offset + limit
+        order = self._order(query.sort_by)
+
+        if candidates is None and not skipped:
+            total = total_rows
+            if query.descending:
+                page = [order[i] for i in range(total - 1 - offset, max(total - 1 - wanted, -1), -1)]
+            else:
+                page = list(order[offset:wanted])
+        elif candidates is not None and len(candidates) * self.SPARSE_RATIO < total_rows:
+            total = len(candidates)
+            page = sorted(candidates)
+            key = self._sort_key(query.sort_by)
+            if key is not None:
+                page.sort(key=key)
+            if query.descending:
+                page.reverse()
+            page = page[offset:wanted]
+        else:
+            # Dense result: walk the presorted order and stop once the page is full
+            if candidates is None:
+                total = total_rows - len(skipped)
+                accept = lambda row: row not in skipped
+            else:
+                total = len(candidates)
+                accept = candidates.__contains__
+            walk = reversed(order) if query.descending else order
+            matched = []
+            for row in walk:
+                if accept(row):
+                    matched.append(row)
+                    if len(matched) >= wanted:
+                        break
+            page = matched[offset:]
+
+        return SegmentQueryResult(
+            total=total,
+            offset=offset,
+            limit=limit,
+            ids=[SegmentRef(file_index=self.rows[row][0], trans_unit_id=self.ids[row]) for row in page]
+        )
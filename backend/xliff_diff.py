@@ -0,0 +1,200 @@
+"""
+Structural diff between two XLIFF documents
+
+Both documents are read as streams of trans-units keyed by (file original,
+trans-unit id) and merge-joined in document order. Units that arrive out of
+step are parked until their counterpart shows up, so only added, removed or
+moved units are held in memory. A content hash of each unit's serialized XML
+lets identical units be skipped without parsing them.
+"""
+
+import difflib
+import hashlib
+import re
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from lxml import etree
+from models import DiffResult, SegmentContent, TextDiffOp, TransUnit, UnitDiff
+from xliff_parser import XliffParser
+from xliff_query import XliffQuery
+
+class DiffUnit(NamedTuple):
+    """A trans-unit in a diff stream"""
+    key: Tuple[Optional[str], str]  # (file original, trans-unit id)
+    digest: bytes
+    element: etree.Element
+
+class XliffDiff:
+    """Merge-join diff of two trans-unit streams"""
+
+    # Tags (as markers), words, whitespace runs and single symbols
+    TOKEN = re.compile(r'⟨[^⟩]*⟩|\w+|\s+|[^\w\s]')
+
+    @staticmethod
+    def _digest(tu_elem: etree.Element) -> bytes:
+        return hashlib.blake2b(etree.tostring(tu_elem, with_tail=False), digest_size=16).digest()
+
+    @staticmethod
+    def iter_tree(tree: etree.Element,
+                  trans_units: Optional[Iterable[Tuple[int, etree.Element]]] = None) -> Iterator[DiffUnit]:
+        """
+        Trans-units of a loaded tree in document order
+        trans_units yields (file index, element) pairs in place of the tree's own trans-units
+        """
+        query = XliffQuery.for_element(tree)
+        # File originals are read up front, so the tree isn't touched while the units stream
+        originals = [file_elem.get('original') for file_elem in query.files(tree)]
+        if trans_units is None:
+            trans_units = ((index, tu_elem) for index, file_elem in enumerate(query.files(tree))
+                           for tu_elem in query.file_trans_units(file_elem))
+        return XliffDiff._units(originals, trans_units)
+
+    @staticmethod
+    def _units(originals: List[Optional[str]], trans_units: Iterable[Tuple[int, etree.Element]]) -> Iterator[DiffUnit]:
+        for file_index, tu_elem in trans_units:
+            yield DiffUnit((originals[file_index], tu_elem.get('id')), XliffDiff._digest(tu_elem), tu_elem)
+
+    @staticmethod
+    def iter_stream(fileobj: BinaryIO) -> Iterator[DiffUnit]:
+        """Trans-units of an XLIFF file read with iterparse; handled units are released"""
+        for original, elem in XliffQuery.iterparse_trans_units(fileobj):
+            yield DiffUnit((original, elem.get('id')), XliffDiff._digest(elem), elem)
+
+    @staticmethod
+    def _parse(unit: DiffUnit) -> TransUnit:
+        """Parse a unit's element into the document model (namespace taken from the element)"""
+        return XliffParser.parse_trans_unit(unit.element)
+
+    @staticmethod
+    def text_diff(old: str, new: str) -> List[TextDiffOp]:
+        """Token-level diff that keeps tag markers intact"""
+        old_tokens = XliffDiff.TOKEN.findall(old)
+        new_tokens = XliffDiff.TOKEN.findall(new)
+        matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+
+        ops: List[TextDiffOp] = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                ops.append(TextDiffOp(op='equal', text=''.join(old_tokens[i1:i2])))
+                continue
+            if i2 > i1:
+                ops.append(TextDiffOp(op='delete', text=''.join(old_tokens[i1:i2])))
+            if j2 > j1:
+                ops.append(TextDiffOp(op='insert', text=''.join(new_tokens[j1:j2])))
+        return ops
+
+    @staticmethod
+    def _same_segment(a: Optional[SegmentContent], b: Optional[SegmentContent]) -> Tuple[bool, bool]:
+        """(text equal, tags equal) of two segments"""
+        if a is None or b is None:
+            return a is None and b is None, a is None and b is None
+        same_tags = [t.model_dump() for t in a.tags] == [t.model_dump() for t in b.tags]
+        return a.text == b.text, same_tags
+
+    @staticmethod
+    def compare(old: TransUnit, new: TransUnit, key: Tuple[Optional[str], str],
+                with_text_diff: bool = True) -> Optional[UnitDiff]:
+        """Deep compare two versions of a trans-unit; None if they are equivalent"""
+        fields = []
+        source_text_equal, source_tags_equal = XliffDiff._same_segment(old.source, new.source)
+        target_text_equal, target_tags_equal = XliffDiff._same_segment(old.target, new.target)
+        if not source_text_equal:
+            fields.append('source')
+        if not source_tags_equal:
+            fields.append('source_tags')
+        if not target_text_equal:
+            fields.append('target')
+        if not target_tags_equal:
+            fields.append('target_tags')
+        if old.state != new.state:
+            fields.append('state')
+        if old.notes != new.notes:
+            fields.append('notes')
+        if old.attributes != new.attributes:
+            fields.append('attributes')
+
+        if not fields:
+            return None
+
+        diff = UnitDiff(
+            file=key[0],
+            trans_unit_id=key[1],
+            change='modified',
+            fields=fields,
+            old_state=old.state,
+            new_state=new.state
+        )
+        if with_text_diff:
+            if 'source' in fields:
+                diff.source_diff = XliffDiff.text_diff(old.source.text if old.source else '',
+                                                       new.source.text if new.source else '')
+            if 'target' in fields:
+                diff.target_diff = XliffDiff.text_diff(old.target.text if old.target else '',
+                                                       new.target.text if new.target else '')
+        return diff
+
+    @staticmethod
+    def diff(old_units: Iterator[DiffUnit], new_units: Iterator[DiffUnit],
+             with_text_diff: bool = True) -> DiffResult:
+        """
+        Merge-join two unit streams and collect the changes
+        Memory grows with the number of changed or reordered units, not with the document size
+        """
+        result = DiffResult()
+        changes: List[UnitDiff] = []
+
+        # Units seen on one side whose counterpart has not arrived yet (parsed when parked)
+        pending_old: Dict[Tuple[Optional[str], str], Tuple[bytes, TransUnit]] = {}
+        pending_new: Dict[Tuple[Optional[str], str], Tuple[bytes, TransUnit]] = {}
+
+        def pair(key, old_digest, old_unit, new_digest, new_unit):
+            if old_digest == new_digest:
+                result.unchanged += 1
+                return
+            change = XliffDiff.compare(old_unit(), new_unit(), key, with_text_diff)
+            if change is None:
+                result.unchanged += 1
+            else:
+                result.modified += 1
+                changes.append(change)
+
+        def take(unit: DiffUnit, own: Dict, other: Dict, is_old: bool):
+            match = other.pop(unit.key, None)
+            if match is None:
+                own[unit.key] = (unit.digest, XliffDiff._parse(unit))
+                return
+            digest, parsed = match
+            if is_old:
+                pair(unit.key, unit.digest, lambda: XliffDiff._parse(unit), digest, lambda: parsed)
+            else:
+                pair(unit.key, digest, lambda: parsed, unit.digest, lambda: XliffDiff._parse(unit))
+
+        old_iter = iter(old_units)
+        new_iter = iter(new_units)
+        while True:
+            old_unit = next(old_iter, None)
+            new_unit = next(new_iter, None)
+            if old_unit is None and new_unit is None:
+                break
+
+            if old_unit is not None and new_unit is not None and old_unit.key == new_unit.key \
+                    and old_unit.key not in pending_new and new_unit.key not in pending_old:
+                # In step: the common case
+                pair(old_unit.key, old_unit.digest, lambda: XliffDiff._parse(old_unit),
+                     new_unit.digest, lambda: XliffDiff._parse(new_unit))
+                continue
+
+            if old_unit is not None:
+                take(old_unit, pending_old, pending_new, is_old=True)
+            if new_unit is not None:
+                take(new_unit, pending_new, pending_old, is_old=False)
+
+        for key, (_, parsed) in pending_old.items():
+            result.removed += 1
+            changes.append(UnitDiff(file=key[0], trans_unit_id=key[1], change='removed', old_state=parsed.state))
+        for key, (_, parsed) in pending_new.items():
+            result.added += 1
+            changes.append(UnitDiff(file=key[0], trans_unit_id=key[1], change='added', new_state=parsed.state))
+
+        result.total_changes = len(changes)
+        result.changes = changes
+        return result
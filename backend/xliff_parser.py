@@ -1,37 +1,17 @@
-﻿from lxml import etree
+﻿import re
+from lxml import etree
 from models import XliffDocument, XliffFile, TransUnit, SegmentContent, XliffTag
-from typing import List, Tuple, Dict
+from typing import Iterable, List, Tuple, Dict
+from xliff_query import XliffQuery
 
 class XliffParser:
     """Parser for XLIFF 1.1 and 1.2 files with support for various tag types"""
     
-    # Support both XLIFF 1.1 and 1.2 namespaces
-    XLIFF_NS_12 = {'xliff': 'urn:oasis:names:tc:xliff:document:1.2'}
-    XLIFF_NS_11 = {'xliff': 'urn:oasis:names:tc:xliff:document:1.1'}
-    
     # Supported inline tag types
     INLINE_TAGS = {'g', 'x', 'bpt', 'ept', 'ph', 'it', 'mrk', 'sub', 'bx', 'ex'}
     
-    @staticmethod
-    def detect_namespace(tree) -> tuple:
-        """
-        Detect which XLIFF namespace version is being used
-        Returns (namespace_dict, use_namespace_prefix)
-        """
-        root_ns = tree.nsmap.get(None, '')
-        
-        # Check if file has no default namespace (common with some CAT tools)
-        if not root_ns or root_ns == '':
-            # No namespace - elements are in null namespace
-            return ({}, False)
-        
-        if '1.2' in root_ns:
-            return (XliffParser.XLIFF_NS_12, True)
-        elif '1.1' in root_ns:
-            return (XliffParser.XLIFF_NS_11, True)
-        else:
-            # Default to 1.2 with namespace
-            return (XliffParser.XLIFF_NS_12, True)
+    # Inline tag markers in segment text (⟨g⟩, ⟨mrk⟩, ...)
+    TAG_MARKER = re.compile(r'⟨[^⟩]*⟩')
     
     @staticmethod
     def parse_segment(element) -> SegmentContent:
@@ -94,100 +74,90 @@ class XliffParser:
         return SegmentContent(text=full_text, tags=tags)
     
     @staticmethod
-    def parse_trans_unit(tu_element, namespace=None, use_prefix=True) -> TransUnit:
+    def segment_text(element) -> str:
+        """Text of a source or target element as parse_segment returns it, without building tag models"""
+        if element is None:
+            return None
+        
+        text_parts = [element.text or '']
+        for child in element:
+            tag_type = etree.QName(child).localname
+            if tag_type in XliffParser.INLINE_TAGS:
+                text_parts.append(f"⟨{tag_type}⟩")
+            text_parts.append(child.tail or '')
+        
+        return ''.join(text_parts)
+    
+    @staticmethod
+    def parse_trans_unit(tu_element, query: XliffQuery = None) -> TransUnit:
         """Parse a single trans-unit element"""
-        if namespace is None:
-            namespace = XliffParser.XLIFF_NS_12
+        if query is None:
+            query = XliffQuery.for_element(tu_element)
         
         # Find source and target
-        if use_prefix:
-            source_elem = tu_element.find('xliff:source', namespace)
-            target_elem = tu_element.find('xliff:target', namespace)
-            note_elements = tu_element.findall('xliff:note', namespace)
-        else:
-            source_elem = tu_element.find('source')
-            target_elem = tu_element.find('target')
-            note_elements = tu_element.findall('note')
+        source_elem = tu_element.find(query.source_tag)
+        target_elem = tu_element.find(query.target_tag)
+        seg_source_elem = tu_element.find(query.seg_source_tag)
+        note_elements = tu_element.findall(query.note_tag)
         
         # Parse notes
         notes = [note.text for note in note_elements if note.text]
         
+        # Collect sub-segment ids from <seg-source> (used by SDLXLIFF);
+        # their content is only parsed when requested
+        segment_ids = []
+        if seg_source_elem is not None:
+            segment_ids = [mrk.get('mid') for mrk in seg_source_elem.iter(query.mrk_tag)
+                           if mrk.get('mtype') == 'seg' and mrk.get('mid') is not None]
+        
         return TransUnit(
             id=tu_element.get('id'),
             source=XliffParser.parse_segment(source_elem),
             target=XliffParser.parse_segment(target_elem) if target_elem is not None else None,
             state=target_elem.get('state') if target_elem is not None else None,
             notes=notes,
-            attributes={k: v for k, v in tu_element.attrib.items() if k != 'id'}
+            attributes={k: v for k, v in tu_element.attrib.items() if k != 'id'},
+            segment_ids=segment_ids
         )
     
     @staticmethod
-    def extract_trans_units_recursive(element, namespace, use_prefix) -> List[TransUnit]:
-        """Recursively extract trans-units from an element and its groups"""
-        trans_units = []
-        
-        # Get trans-units directly in this element
-        if use_prefix:
-            tu_elements = element.findall('xliff:trans-unit', namespace)
-        else:
-            tu_elements = element.findall('trans-unit')
-        
-        for tu_elem in tu_elements:
-            trans_units.append(XliffParser.parse_trans_unit(tu_elem, namespace, use_prefix))
-        
-        # Recursively get trans-units from group elements
-        if use_prefix:
-            group_elements = element.findall('xliff:group', namespace)
-        else:
-            group_elements = element.findall('group')
-        
-        for group_elem in group_elements:
-            trans_units.extend(XliffParser.extract_trans_units_recursive(group_elem, namespace, use_prefix))
-        
-        return trans_units
+    def extract_trans_units(tu_elements: Iterable, query: XliffQuery) -> List[TransUnit]:
+        """Parse trans-unit elements (e.g. all of a file's body, at any group depth)"""
+        return [XliffParser.parse_trans_unit(tu_elem, query) for tu_elem in tu_elements]
     
     @staticmethod
     def parse_file(content: bytes) -> XliffDocument:
         """Parse XLIFF file content (supports XLIFF 1.1 and 1.2, with or without namespace)"""
-        tree = etree.fromstring(content)
-        
-        # Detect namespace version and whether to use prefix
-        namespace, use_prefix = XliffParser.detect_namespace(tree)
+        return XliffParser.parse_tree(etree.fromstring(content))
+    
+    @staticmethod
+    def parse_tree(tree: etree.Element) -> XliffDocument:
+        """Parse an already loaded XLIFF tree into the document model"""
+        query = XliffQuery.for_element(tree)
         
         # Get version
         version = tree.get('version', '1.2')
         
         files = []
         
-        # Find file elements
-        if use_prefix:
-            file_elements = tree.findall('xliff:file', namespace)
-        else:
-            file_elements = tree.findall('file')
-        
-        for file_elem in file_elements:
-            # Find body element
-            if use_prefix:
-                body_elem = file_elem.find('xliff:body', namespace)
-            else:
-                body_elem = file_elem.find('body')
-            
-            trans_units = []
-            if body_elem is not None:
-                # Extract all trans-units (including those in nested groups)
-                trans_units = XliffParser.extract_trans_units_recursive(body_elem, namespace, use_prefix)
-            
-            xliff_file = XliffFile(
-                original=file_elem.get('original'),
-                source_language=file_elem.get('source-language'),
-                target_language=file_elem.get('target-language'),
-                datatype=file_elem.get('datatype'),
-                trans_units=trans_units
-            )
-            files.append(xliff_file)
+        for file_elem in query.files(tree):
+            # Extract all trans-units (including those in nested groups) in document order
+            trans_units = XliffParser.extract_trans_units(query.file_trans_units(file_elem), query)
+            files.append(XliffParser.parse_file_element(file_elem, trans_units))
         
         return XliffDocument(version=version, files=files)
     
+    @staticmethod
+    def parse_file_element(file_elem, trans_units: List[TransUnit]) -> XliffFile:
+        """File model from a <file> element's attributes and its parsed trans-units"""
+        return XliffFile(
+            original=file_elem.get('original'),
+            source_language=file_elem.get('source-language'),
+            target_language=file_elem.get('target-language'),
+            datatype=file_elem.get('datatype'),
+            trans_units=trans_units
+        )
+    
     @staticmethod
     def reconstruct_segment(text: str, tags: List[XliffTag], parent_elem):
         """Reconstruct a segment element with inline tags"""
@@ -247,69 +217,19 @@ class XliffParser:
             last_element.tail = (last_element.tail or '') + remaining_text
     
     @staticmethod
-    def update_trans_unit(tree: etree.Element, file_index: int, trans_unit_id: str, 
-                         target_text: str, target_tags: List[XliffTag]) -> bytes:
-        """Update a trans-unit's target in the XML tree"""
-        # Detect namespace
-        namespace, use_prefix = XliffParser.detect_namespace(tree)
-        
-        # Find file element
-        if use_prefix:
-            file_elements = tree.findall('xliff:file', namespace)
-        else:
-            file_elements = tree.findall('file')
+    def update_target_element(tu_elem, target_text: str, target_tags: List[XliffTag], state: str = None):
+        """Find or create the target of a trans-unit element and rebuild it with the given text and tags"""
+        # Use the trans-unit's namespace (or none)
+        target_tag = XliffQuery.for_element(tu_elem).target_tag
         
-        file_elem = file_elements[file_index]
+        target_elem = tu_elem.find(target_tag)
+        if target_elem is None:
+            target_elem = etree.SubElement(tu_elem, target_tag)
         
-        # Find body element
-        if use_prefix:
-            body_elem = file_elem.find('xliff:body', namespace)
-        else:
-            body_elem = file_elem.find('body')
+        # Reconstruct the target with tags
+        XliffParser.reconstruct_segment(target_text, target_tags, target_elem)
         
-        # Find the trans-unit (may be in groups)
-        def find_trans_unit_in_element(element, tu_id):
-            # Check direct children
-            if use_prefix:
-                tu_elements = element.findall('xliff:trans-unit', namespace)
-            else:
-                tu_elements = element.findall('trans-unit')
-            
-            for tu_elem in tu_elements:
-                if tu_elem.get('id') == tu_id:
-                    return tu_elem
-            
-            # Check in groups
-            if use_prefix:
-                group_elements = element.findall('xliff:group', namespace)
-            else:
-                group_elements = element.findall('group')
-            
-            for group_elem in group_elements:
-                result = find_trans_unit_in_element(group_elem, tu_id)
-                if result is not None:
-                    return result
-            
-            return None
-        
-        tu_elem = find_trans_unit_in_element(body_elem, trans_unit_id)
-        
-        if tu_elem is not None:
-            # Find or create target element
-            if use_prefix:
-                target_elem = tu_elem.find('xliff:target', namespace)
-            else:
-                target_elem = tu_elem.find('target')
-            
-            if target_elem is None:
-                # Determine the correct namespace URI (or none)
-                if use_prefix:
-                    ns_uri = namespace['xliff']
-                    target_elem = etree.SubElement(tu_elem, f'{{{ns_uri}}}target')
-                else:
-                    target_elem = etree.SubElement(tu_elem, 'target')
-            
-            # Reconstruct the target with tags
-            XliffParser.reconstruct_segment(target_text, target_tags, target_elem)
+        if state is not None:
+            target_elem.set('state', state)
         
-        return etree.tostring(tree, encoding='utf-8', xml_declaration=True, pretty_print=True)
\ No newline at end of file
+        return target_elem
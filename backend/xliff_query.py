@@ -0,0 +1,108 @@
+"""
+Namespace-agnostic queries on XLIFF trees
+
+XLIFF 1.2, 1.1 and namespace-less files only differ in the namespace of their
+elements. An XliffQuery holds the qualified tag names and compiled XPath
+expressions for one namespace, and is shared by every tree using it, so all
+traversals go through the same code path without branching on prefixes.
+Descendants (trans-units at any group depth) are walked with a single
+tag-filtered iter(), which lxml runs in C. Files read as a stream go through
+iterparse_trans_units, which releases each unit once it has been handled.
+"""
+
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from lxml import etree
+
+class XliffQuery:
+    """Qualified tags and compiled XPath expressions for one XLIFF namespace (or none)"""
+
+    _cache: Dict[Optional[str], 'XliffQuery'] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, namespace: Optional[str]):
+        self.namespace = namespace
+        self._tags: Dict[str, str] = {}
+
+        self.file_tag = self.tag('file')
+        self.body_tag = self.tag('body')
+        self.group_tag = self.tag('group')
+        self.trans_unit_tag = self.tag('trans-unit')
+        self.source_tag = self.tag('source')
+        self.target_tag = self.tag('target')
+        self.seg_source_tag = self.tag('seg-source')
+        self.note_tag = self.tag('note')
+        self.mrk_tag = self.tag('mrk')
+
+        prefix = 'x:' if namespace else ''
+        namespaces = {'x': namespace} if namespace else None
+        self._files = etree.XPath(f'{prefix}file', namespaces=namespaces)
+
+    @classmethod
+    def for_namespace(cls, namespace: Optional[str]) -> 'XliffQuery':
+        """Shared query object of a namespace (None for namespace-less files)"""
+        query = cls._cache.get(namespace or None)
+        if query is None:
+            with cls._lock:
+                query = cls._cache.setdefault(namespace or None, cls(namespace or None))
+        return query
+
+    @classmethod
+    def for_element(cls, element: etree.Element) -> 'XliffQuery':
+        """Query object matching the namespace of an element (the root or any XLIFF element)"""
+        return cls.for_namespace(etree.QName(element).namespace)
+
+    def tag(self, name: str) -> str:
+        """Qualified tag name of an XLIFF element in this namespace"""
+        tag = self._tags.get(name)
+        if tag is None:
+            tag = self._tags[name] = etree.QName(self.namespace, name).text
+        return tag
+
+    def files(self, tree: etree.Element) -> List[etree.Element]:
+        """<file> elements of the document"""
+        return self._files(tree)
+
+    def body(self, file_elem: etree.Element) -> Optional[etree.Element]:
+        return file_elem.find(self.body_tag)
+
+    def trans_units(self, element: etree.Element) -> Iterator[etree.Element]:
+        """Trans-units below an element at any group depth, in document order"""
+        return element.iter(self.trans_unit_tag)
+
+    def file_trans_units(self, file_elem: etree.Element) -> Iterator[etree.Element]:
+        """Trans-units of a file's <body> in document order"""
+        body_elem = self.body(file_elem)
+        return iter(()) if body_elem is None else self.trans_units(body_elem)
+
+    def child(self, element: etree.Element, name: str) -> Optional[etree.Element]:
+        """First direct XLIFF child with the given name"""
+        return element.find(self.tag(name))
+
+    @staticmethod
+    def release(elem: etree.Element):
+        """Free an element handled during iterparse (and its earlier siblings), so memory stays constant"""
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+
+    @staticmethod
+    def iterparse_trans_units(fileobj: BinaryIO) -> Iterator[Tuple[Optional[str], etree.Element]]:
+        """
+        (original of its <file>, element) of each trans-unit of an XLIFF stream (any version
+        or namespace); an element is released when the consumer asks for the next one
+        """
+        original = None
+        for event, elem in etree.iterparse(fileobj, events=('start', 'end'),
+                                           tag=('{*}file', '{*}trans-unit'), huge_tree=True):
+            if etree.QName(elem).localname == 'file':
+                if event == 'start':
+                    original = elem.get('original')
+                continue
+            if event != 'end':
+                continue
+
+            yield original, elem
+            XliffQuery.release(elem)
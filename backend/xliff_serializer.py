@@ -0,0 +1,194 @@
+"""
+Incremental serialization of a loaded XLIFF tree
+
+The document is split into static shells (start and end tags of the root,
+<file>, <body> and large <group> elements with their text) and chunks of
+consecutive children of <body>/<group>. A chunk keeps its serialized bytes
+until an edit inside it marks it dirty, so a download after a few edits only
+re-encodes the chunks holding them and joins the rest from cache. Chunks are
+serialized from their own elements, so the tree is only ever read. The output
+is byte-identical to etree.tostring(root, encoding='utf-8', xml_declaration=True).
+"""
+
+import threading
+from typing import Dict, List, Optional, Union
+from xml.sax.saxutils import quoteattr
+from lxml import etree
+from xliff_query import XliffQuery
+
+class SerializedChunk:
+    """Consecutive sibling elements serialized together"""
+
+    __slots__ = ('elements', 'redundant', 'file_index', 'data')
+
+    def __init__(self, elements: List[etree.Element], redundant: List[bytes], file_index: Optional[int]):
+        self.elements = elements
+        # Declarations of the parent's scope that lxml repeats on a subtree serialized on its own
+        self.redundant = redundant
+        self.file_index = file_index  # <file> the elements are in (None outside any)
+        self.data: Optional[bytes] = None
+
+class IncrementalSerializer:
+    """Serializer caching the bytes of unchanged regions of a tree"""
+
+    # Children of <body>/<group> per chunk; groups with more trans-units are split further
+    CHUNK_SIZE = 256
+
+    def __init__(self, tree: etree.Element):
+        self.tree = tree
+        # Concurrent downloads serialize each dirty chunk once
+        self._lock = threading.Lock()
+        self.query = XliffQuery.for_element(tree)
+        self.parts: List[Union[bytes, SerializedChunk]] = []
+        self.chunks: List[SerializedChunk] = []
+        # Direct children of containers (and other children of <file>) -> their chunk
+        self.chunk_of: Dict[etree.Element, SerializedChunk] = {}
+        self._build()
+
+    @staticmethod
+    def _declarations(element: etree.Element) -> List[bytes]:
+        """Namespace declarations in scope at an element, as lxml writes them"""
+        declarations = []
+        for prefix, uri in element.nsmap.items():
+            name = b' xmlns' if prefix is None else b' xmlns:' + prefix.encode('utf-8')
+            declarations.append(name + b'=' + quoteattr(uri).encode('utf-8'))
+        return declarations
+
+    @staticmethod
+    def _strip(data: bytes, declarations: List[bytes]) -> bytes:
+        """Remove repeated declarations from the first start tag"""
+        # Quotes are escaped in attribute values, so a declaration can only match a real one
+        if not declarations:
+            return data
+        end = data.index(b'>')
+        start_tag = data[:end]
+        for declaration in declarations:
+            start_tag = start_tag.replace(declaration, b'', 1)
+        return start_tag + data[end:]
+
+    @staticmethod
+    def _shell(element: etree.Element):
+        """(start tag with text, end tag with tail) of an element as they appear in the full document"""
+        parent = element.getparent()
+        copy = etree.Element(element.tag, nsmap=element.nsmap)
+        for name, value in element.attrib.items():
+            copy.set(name, value)
+        empty = len(element) == 0 and element.text is None
+        if not empty:
+            # Empty text still writes a start and an end tag
+            copy.text = ''
+
+        if parent is None:
+            data = etree.tostring(copy, encoding='utf-8', xml_declaration=True)
+            tail = b''
+        else:
+            data = IncrementalSerializer._strip(etree.tostring(copy, encoding='utf-8'),
+                                                IncrementalSerializer._declarations(parent))
+            tail = (element.tail or '').encode('utf-8')
+
+        if empty:
+            # Written as an empty-element tag
+            return data, tail
+        split = data.rindex(b'</')
+        return data[:split] + (element.text or '').encode('utf-8'), data[split:] + tail
+
+    def _subtree_size(self, element: etree.Element) -> int:
+        return sum(1 for _ in self.query.trans_units(element))
+
+    def _add_chunk(self, elements: List[etree.Element], file_index: Optional[int]):
+        if not elements:
+            return
+        chunk = SerializedChunk(elements, self._declarations(elements[0].getparent()), file_index)
+        for element in elements:
+            self.chunk_of[element] = chunk
+        self.chunks.append(chunk)
+        self.parts.append(chunk)
+
+    def _add_container(self, container: etree.Element, file_index: int):
+        """A <body>/<group> whose children are split into chunks"""
+        start, end = self._shell(container)
+        self.parts.append(start)
+
+        batch: List[etree.Element] = []
+        for child in container:
+            if child.tag == self.query.group_tag and self._subtree_size(child) > self.CHUNK_SIZE:
+                self._add_chunk(batch, file_index)
+                batch = []
+                self._add_container(child, file_index)
+                continue
+            batch.append(child)
+            if len(batch) >= self.CHUNK_SIZE:
+                self._add_chunk(batch, file_index)
+                batch = []
+        self._add_chunk(batch, file_index)
+
+        self.parts.append(end)
+
+    def _add_element(self, element: etree.Element, file_index: Optional[int] = None):
+        """The root or a <file>: <file> and <body> children are expanded, others are one chunk each"""
+        start, end = self._shell(element)
+        self.parts.append(start)
+
+        for child in element:
+            if child.tag == self.query.file_tag:
+                self._file_count += 1
+                self._add_element(child, self._file_count - 1)
+            elif child.tag == self.query.body_tag and file_index is not None:
+                self._add_container(child, file_index)
+            else:
+                self._add_chunk([child], file_index)
+
+        self.parts.append(end)
+
+    def _build(self):
+        self.parts = []
+        self.chunks = []
+        self.chunk_of = {}
+        self._file_count = 0
+        self._add_element(self.tree)
+
+    def _serialize_chunk(self, chunk: SerializedChunk) -> bytes:
+        data = []
+        for element in chunk.elements:
+            serialized = etree.tostring(element, encoding='utf-8', with_tail=True)
+            if isinstance(element.tag, str):
+                serialized = self._strip(serialized, chunk.redundant)
+            data.append(serialized)
+        return b''.join(data)
+
+    def mark_dirty(self, element: etree.Element):
+        """Invalidate the chunk containing an edited element (everything if it is outside the chunks)"""
+        with self._lock:
+            node = element
+            while node is not None:
+                chunk = self.chunk_of.get(node)
+                if chunk is not None:
+                    chunk.data = None
+                    return
+                node = node.getparent()
+            self._build()
+
+    def chunk_data(self, chunk: SerializedChunk) -> bytes:
+        """Serialized bytes of one chunk (cached until it is marked dirty)"""
+        with self._lock:
+            if chunk.data is None:
+                chunk.data = self._serialize_chunk(chunk)
+            return chunk.data
+
+    @staticmethod
+    def parse_chunk(chunk: SerializedChunk, data: bytes) -> etree.Element:
+        """Parse a chunk's bytes on their own, in a wrapper declaring the namespaces of its parent"""
+        return etree.fromstring(b'<chunk' + b''.join(chunk.redundant) + b'>' + data + b'</chunk>')
+
+    def serialize(self) -> bytes:
+        """The whole document, re-encoding only the chunks changed since the last call"""
+        with self._lock:
+            output = []
+            for part in self.parts:
+                if isinstance(part, SerializedChunk):
+                    if part.data is None:
+                        part.data = self._serialize_chunk(part)
+                    output.append(part.data)
+                else:
+                    output.append(part)
+            return b''.join(output)
@@ -23,6 +23,7 @@ interface TransUnit {
   state?: string;
   notes: string[];
   attributes: Record<string, any>;
+  version: number;
 }
 
 interface XliffFile {
@@ -36,10 +37,16 @@ interface XliffFile {
 interface XliffDocument {
   version: string;
   files: XliffFile[];
+  document_id?: string;
+  document_version?: number;
 }
 
 const API_BASE = 'http://localhost:8000';
 
+// Pin requests to the document shown in this tab (the server defaults to the latest upload)
+const documentQuery = (doc: XliffDocument | null) =>
+  doc?.document_id ? `?document_id=${encodeURIComponent(doc.document_id)}` : '';
+
 export default function XliffEditor() {
   const [xliffDocument, setXliffDocument] = useState<XliffDocument | null>(null);
   const [selectedTransUnit, setSelectedTransUnit] = useState<{fileIndex: number, tuIndex: number} | null>(null);
@@ -92,7 +99,7 @@ export default function XliffEditor() {
 
   const handleDownload = async () => {
     try {
-      const response = await fetch(`${API_BASE}/download`);
+      const response = await fetch(`${API_BASE}/download${documentQuery(xliffDocument)}`);
       
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
@@ -137,7 +144,7 @@ export default function XliffEditor() {
     const selectedTU = xliffDocument.files[selectedTransUnit.fileIndex].trans_units[selectedTransUnit.tuIndex];
     
     try {
-      const response = await fetch(`${API_BASE}/trans-unit`, {
+      const response = await fetch(`${API_BASE}/trans-unit${documentQuery(xliffDocument)}`, {
         method: 'PUT',
         headers: {
           'Content-Type': 'application/json',
@@ -146,17 +153,39 @@ export default function XliffEditor() {
           file_index: selectedTransUnit.fileIndex,
           trans_unit_id: selectedTU.id,
           target_text: editingTarget,
-          target_tags: selectedTU.target?.tags || []
+          target_tags: selectedTU.target?.tags || [],
+          // Rejected with 409 if someone else saved this unit since it was loaded
+          expected_version: selectedTU.version
         })
       });
       
+      if (response.status === 409) {
+        // Show the translation that was saved elsewhere, with its version for the next save
+        const current = await fetch(
+          `${API_BASE}/trans-unit/${selectedTransUnit.fileIndex}/${encodeURIComponent(selectedTU.id)}${documentQuery(xliffDocument)}`
+        );
+        if (!current.ok) {
+          throw new Error('Failed to load the current translation');
+        }
+        const currentTU: TransUnit = await current.json();
+        const refreshedDoc = { ...xliffDocument };
+        refreshedDoc.files[selectedTransUnit.fileIndex].trans_units[selectedTransUnit.tuIndex] = currentTU;
+        setXliffDocument(refreshedDoc);
+        alert('This segment was changed elsewhere and now shows the current translation. ' +
+              'Apply your change again and save.');
+        return;
+      }
+      
       if (!response.ok) {
         throw new Error('Failed to save changes');
       }
       
+      const result = await response.json();
+      
       // Update local state
       const updatedDoc = { ...xliffDocument };
       const targetTU = updatedDoc.files[selectedTransUnit.fileIndex].trans_units[selectedTransUnit.tuIndex];
+      targetTU.version = result.version;
       
       if (!targetTU.target) {
         targetTU.target = {
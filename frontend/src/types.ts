@@ -20,6 +20,8 @@ export interface TransUnit {
   state?: string;
   notes: string[];
   attributes: Record<string, any>;
+  version: number;
+  segment_ids: string[];
 }
 
 export interface XliffFile {
@@ -33,6 +35,8 @@ export interface XliffFile {
 export interface XliffDocument {
   version: string;
   files: XliffFile[];
+  document_id?: string;
+  document_version?: number;
 }
 
 export interface TransUnitUpdate {
@@ -40,4 +44,5 @@ export interface TransUnitUpdate {
   trans_unit_id: string;
   target_text: string;
   target_tags: XliffTag[];
+  expected_version?: number;
 }
\ No newline at end of file